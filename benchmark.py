@@ -0,0 +1,224 @@
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from cache import cache_path, read_json, write_json
+from calibration import apply_calibration
+from oxides import compilation_oxides, conv_elem_to_oxides, list_oxides, normalize_compilation
+from spectra import SpectrumSet, parse_spectrum
+from tables import file_conv_oxides, file_deschamps, file_pms, file_pxrf, read_table
+
+raman_folder = r"./Suppl data/Spectra/µ-RS spectra"
+xrd_folder = r"./Suppl data/Spectra/XRD spectra"
+default_scales = [1, 10, 100, 1000]
+
+# columns of the supplementary tables reproduced in the synthetic data (those the figures read)
+synthetic_tables = {
+    "pxrf": (file_pxrf, ["Type", "Facies", "Sample ID", "Ni"] + list_oxides),
+    "pms": (file_pms, ["Sample ID", "vase_type", "SI"]),
+    "deschamps": (file_deschamps, compilation_oxides + ["Total", "Ni"]),
+}
+
+
+# `scale` jittered copies of the rows (numbers * lognormal noise); every copy gets its own Sample IDs
+def _scaled_table(df, scale, rng):
+    df = pd.concat([df] * scale, ignore_index=True)
+    numeric = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c]) and c != "Facies"]
+    df[numeric] = df[numeric] * rng.lognormal(0, 0.05, size=(len(df), len(numeric)))
+    if "Sample ID" in df and scale > 1:
+        copy = np.repeat(np.arange(scale), len(df) // scale).astype(str)
+        df["Sample ID"] = df["Sample ID"].astype(str) + "-" + pd.Series(copy, index=df.index)
+    return df
+
+
+def _write_spectra(paths, folder, scale, rng):
+    for path in paths:
+        data, _ = parse_spectrum(path)
+        with open(path, "r", encoding="latin-1") as f:
+            lines = f.read().splitlines()
+        header = "\n".join(lines[:len(lines) - len(data)])
+        stem = os.path.splitext(os.path.basename(path))[0]
+        for k in range(scale):
+            noisy = np.column_stack([data[:, 0], data[:, 1] * rng.lognormal(0, 0.05, size=len(data))])
+            np.savetxt(os.path.join(folder, f"{stem}-{k}.txt"), noisy, fmt="%.4f\t%.2f", header=header, comments="")
+
+
+# synthetic copy of the supplementary data at `scale` times its size (written once, then reused)
+def synthetic_data(scale, seed=0):
+    folder = os.path.dirname(cache_path("bench", f"x{scale}", "done"))
+    files = {name: os.path.join(folder, f"{name}.xlsx") for name in synthetic_tables}
+    files["raman"] = os.path.join(folder, "raman")
+    files["xrd"] = os.path.join(folder, "xrd")
+    if os.path.exists(os.path.join(folder, "done")):
+        return files
+
+    rng = np.random.default_rng(seed)
+    for name, (file_path, columns) in synthetic_tables.items():
+        print(f"x{scale}: writing {name}")
+        _scaled_table(read_table(file_path, columns=columns), scale, rng).to_excel(files[name], index=False)
+    for name, source in [("raman", raman_folder), ("xrd", xrd_folder)]:
+        print(f"x{scale}: writing {name} spectra")
+        os.makedirs(files[name], exist_ok=True)
+        _write_spectra(sorted(glob.glob(os.path.join(source, "*.txt"))), files[name], scale, rng)
+    with open(os.path.join(folder, "done"), "w") as f:
+        f.write(str(seed))
+    return files
+
+
+# best time of `repeat` runs (the minimum is the least disturbed by other load on the machine);
+# the result of the last run is returned with it
+def _best_time(func, repeat):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _render(draw):
+    import matplotlib.pyplot as plt
+
+    fig = draw(plt)
+    fig.savefig(io.BytesIO(), format="png", dpi=100)
+    plt.close(fig)
+
+
+def _draw_oxides(plt, df_pxrf, df_medians, df_world):
+    import seaborn as sns
+
+    fig, axes = plt.subplots(2, 2, figsize=(10, 10))
+    for ax, (axe_y, axe_x) in zip(axes.flat, [("MgO", "SiO2"), ("Al2O3", "MgO/SiO2"), ("CaO", "MgO/SiO2"),
+                                              ("Ni", "MgO/SiO2")]):
+        sns.scatterplot(data=df_world, x=axe_x, y=axe_y, color="grey", legend=False, alpha=0.1, ax=ax)
+        sns.scatterplot(data=df_pxrf, x=axe_x, y=axe_y, hue="Facies", legend=False, alpha=0.1, ax=ax)
+        sns.scatterplot(data=df_medians, x=axe_x, y=axe_y, hue="Facies", legend=False, ax=ax)
+    fig.tight_layout()
+    return fig
+
+
+def _draw_si(plt, df_medians):
+    import seaborn as sns
+
+    fig, ax = plt.subplots(figsize=(6, 6))
+    sns.boxplot(data=df_medians, y="SI", hue="vase_type", legend=False, ax=ax)
+    return fig
+
+
+def _draw_spectra(plt, spectra):
+    fig, ax = plt.subplots(figsize=(10, 10))
+    for x, y in spectra:
+        ax.plot(x, y, linewidth=0.5)
+    return fig
+
+
+# time every stage on the data of one scale -> {"load/pxrf": seconds, ...}
+def run_scale(scale, repeat=3, render=True):
+    files = synthetic_data(scale)
+    timings = {}
+
+    # every stage is run `repeat` times, single runs of the slow stages being too noisy to compare
+    def stage(name, func):
+        timings[name], result = _best_time(func, repeat)
+        return result
+
+    # load: parsing of the workbooks, then reads from the table cache (filled by the first read_table)
+    conv_oxides = read_table(file_conv_oxides, columns=["Element", "Oxide", "Factor"])
+    tables = {}
+    for name, (_, columns) in synthetic_tables.items():
+        stage(f"load/{name} (xlsx)", lambda name=name: pd.read_excel(files[name]))
+        read_table(files[name])
+        tables[name] = stage(f"load/{name}", lambda name=name, columns=columns: read_table(files[name], columns))
+    raman_files = sorted(glob.glob(os.path.join(files["raman"], "*.txt")))
+    xrd_files = sorted(glob.glob(os.path.join(files["xrd"], "*.txt")))
+    stage("load/raman (text)", lambda: [parse_spectrum(path) for path in raman_files])
+    SpectrumSet.from_files(raman_files)
+    raman = stage("load/raman", lambda: SpectrumSet.from_files(raman_files))
+    stage("load/xrd (text)", lambda: [parse_spectrum(path) for path in xrd_files])
+    SpectrumSet.from_files(xrd_files)
+    xrd = stage("load/xrd", lambda: SpectrumSet.from_files(xrd_files))
+
+    # transform
+    def oxides():
+        df = conv_elem_to_oxides(tables["pxrf"], conv_oxides)
+        df["MgO/SiO2"] = df["MgO"] / df["SiO2"]
+        return df
+    df_pxrf = stage("transform/oxide conversion", oxides)
+    # calibration scales in place: every run gets its own copy, made outside the timed call
+    copies = iter([df_pxrf.copy() for _ in range(repeat)])
+    df_pxrf = stage("transform/calibration", lambda: apply_calibration(next(copies)))
+    plotted = ["MgO", "SiO2", "Al2O3", "CaO", "Ni", "MgO/SiO2"]
+    df_medians = stage("transform/grouping pxrf",
+                       lambda: df_pxrf.groupby(["Sample ID", "Facies"])[plotted].median().reset_index())
+    df_si = stage("transform/grouping pms", lambda: tables["pms"].groupby(
+        ["vase_type", "Sample ID"], as_index=False)["SI"].median())
+    df_world = stage("transform/normalization", lambda: normalize_compilation(tables["deschamps"].copy()))
+    stage("transform/spectra", lambda: (raman.normalize(1000), xrd.normalize(1000)))
+
+    # render (Agg, PNG in memory)
+    if render:
+        stage("render/oxides", lambda: _render(lambda plt: _draw_oxides(plt, df_pxrf, df_medians, df_world)))
+        stage("render/si", lambda: _render(lambda plt: _draw_si(plt, df_si)))
+        stage("render/spectra", lambda: _render(lambda plt: _draw_spectra(plt, SpectrumSet.concat([raman, xrd]))))
+    return timings
+
+
+# stages slower than the baseline by more than `tolerance` (relative) and `min_delta` seconds
+def regressions(results, baseline, tolerance=0.25, min_delta=0.01):
+    found = []
+    for scale, timings in results.items():
+        for name, seconds in timings.items():
+            reference = baseline.get(scale, {}).get(name)
+            if reference is not None and seconds > reference * (1 + tolerance) and seconds - reference > min_delta:
+                found.append((scale, name, reference, seconds))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time load, transform and render on synthetic data "
+                                                 "at multiples of the supplementary data size.")
+    parser.add_argument("--scales", type=int, nargs="+", default=default_scales,
+                        help="size multiples (default: 1 10 100 1000; x1000 writes ~1 GB and takes minutes)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="runs per stage, the best time is kept (xlsx parses included: slow at x1000)")
+    parser.add_argument("--no-render", action="store_true", help="skip the render stages")
+    parser.add_argument("--baseline", help="stored baseline (JSON, default: bench/baseline.json in the cache)")
+    parser.add_argument("--save-baseline", action="store_true", help="store these timings as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="relative slowdown reported as regression")
+    parser.add_argument("-o", "--output", help="write the timings (JSON)")
+    args = parser.parse_args(argv)
+    args.baseline = args.baseline or cache_path("bench", "baseline.json")
+
+    import matplotlib
+    matplotlib.use("Agg")
+    # imports and font loading are not part of the first render
+    _render(lambda plt: _draw_si(plt, pd.DataFrame({"SI": [1.0, 2.0], "vase_type": ["a", "b"]})))
+
+    results = {}
+    for scale in args.scales:
+        results[f"x{scale}"] = run_scale(scale, args.repeat, not args.no_render)
+    baseline = read_json(args.baseline) or {}
+
+    table = pd.DataFrame({scale: pd.Series(timings) for scale, timings in results.items()})
+    print(table.round(4).to_string())
+    if args.output:
+        write_json(args.output, results)
+
+    found = regressions(results, baseline, args.tolerance)
+    for scale, name, reference, seconds in found:
+        print(f"REGRESSION {scale} {name}: {reference:.4f} s -> {seconds:.4f} s ({seconds / reference:.2f}x)")
+    if args.save_baseline:
+        write_json(args.baseline, {**baseline, **results})
+        print(f"baseline -> {args.baseline}")
+    elif not baseline:
+        print("no baseline yet, store one with --save-baseline")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+import argparse
+import ast
+import contextlib
+import glob
+import os
+import runpy
+import sys
+import time
+import traceback
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from cache import file_digest, read_json, write_json
+from calibration import registry_file
+import profiling
+from tables import (file_conv_oxides, file_deschamps, file_munsell, file_pms, file_pxrf, preload_tables,
+                    read_table)
+
+repo_folder = os.path.dirname(os.path.abspath(__file__))
+figure_scripts = ["fig06", "fig07", "fig08", "fig10", "fig11", "fig12"]
+# tables used by several figures: read once by the parent and handed to the workers
+shared_tables = [file_pxrf, file_pms]
+
+# data files read by each figure (glob patterns); the scripts and local modules they import are added automatically
+raman_folder = r"./Suppl data/Spectra/µ-RS spectra"
+xrd_folder = r"./Suppl data/Spectra/XRD spectra"
+figure_data = {
+    "fig06": [file_pxrf, file_conv_oxides, file_deschamps, registry_file],
+    "fig07": [file_pms],
+    "fig08": [file_pms],
+    "fig10": [file_munsell],
+    "fig11": [os.path.join(raman_folder, "MS43B*_0[3-8].txt")]
+             + [os.path.join(raman_folder, "Reference spectra", f"{ref}.txt")
+                for ref in ["lizardite", "olivine", "magnetite", "hematite"]],
+    "fig12": [os.path.join(xrd_folder, "*.txt")],
+}
+# environment variables changing what a figure draws; recorded in the manifest with the dpi
+figure_environment = {
+    "fig06": ["FIG06_BACKGROUND", "SERP_STORE"],
+    "fig07": ["SERP_STORE"],
+    "fig08": ["SERP_STORE"],
+    "fig11": ["FIG11_PREPROCESS"],
+}
+manifest_name = "manifest.json"
+
+
+# repository modules imported (directly or not) by a script
+def _local_modules(script_path, found=None):
+    found = set() if found is None else found
+    with open(script_path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            path = os.path.join(repo_folder, name.split(".")[0] + ".py")
+            if os.path.exists(path) and path not in found:
+                found.add(path)
+                _local_modules(path, found)
+    return found
+
+
+# every file a figure depends on, relative to the repository
+def figure_inputs(name):
+    script = os.path.join(repo_folder, name + ".py")
+    files = {script} | _local_modules(script)
+    patterns = list(figure_data[name])
+    if "SERP_STORE" in figure_environment.get(name, []) and "SERP_STORE" in os.environ:
+        # medians read from the reading store: its logs are inputs as well
+        patterns.append(os.path.join(os.path.abspath(os.environ["SERP_STORE"]), "readings-*.jsonl"))
+    for pattern in patterns:
+        files.update(os.path.abspath(path) for path in glob.glob(os.path.join(repo_folder, pattern)))
+    return sorted(os.path.relpath(path, repo_folder) for path in files)
+
+
+# rendering settings of a figure besides its input files
+def figure_settings(name, dpi):
+    return {"dpi": dpi, **{variable: os.environ.get(variable) for variable in figure_environment.get(name, [])}}
+
+
+# {file: {digest, mtime_ns, size}}; files whose stat did not change keep their previous digest
+def _input_stamps(files, previous=None):
+    previous = previous or {}
+    stamps = {}
+    for rel_path in files:
+        stat = os.stat(os.path.join(repo_folder, rel_path))
+        old = previous.get(rel_path)
+        if old and old["mtime_ns"] == stat.st_mtime_ns and old["size"] == stat.st_size:
+            stamps[rel_path] = old
+        else:
+            stamps[rel_path] = {"digest": file_digest(os.path.join(repo_folder, rel_path)),
+                                "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    return stamps
+
+
+def read_manifest(output_folder):
+    return read_json(os.path.join(output_folder, manifest_name)) or {}
+
+
+# figures whose inputs or settings changed since the last build, or whose outputs are missing
+# retry_failed=False: a figure that failed is only rebuilt once its inputs change
+def stale_figures(names, output_folder, formats, dpi=300, manifest=None, retry_failed=True):
+    output_folder = os.path.abspath(output_folder)
+    manifest = read_manifest(output_folder) if manifest is None else manifest
+    stale = []
+    for name in names:
+        entry = manifest.get(name)
+        if entry is None or not set(formats) <= set(entry["formats"]) or ("error" in entry and retry_failed) \
+                or entry.get("settings") != figure_settings(name, dpi):
+            stale.append(name)
+            continue
+        stamps = _input_stamps(figure_inputs(name), entry["inputs"])
+        digests = {path: stamp["digest"] for path, stamp in stamps.items()}
+        if digests != {path: stamp["digest"] for path, stamp in entry["inputs"].items()} \
+                or not all(os.path.exists(os.path.join(output_folder, path)) for path in entry["outputs"]):
+            stale.append(name)
+    return stale
+
+
+def _init_worker(tables):
+    import matplotlib
+    matplotlib.use("Agg")
+    os.chdir(repo_folder)
+    preload_tables(tables)
+    profiling.enable_from_environment()
+
+
+# run one figure script headless and save every figure it opened
+def render_figure(name, output_folder, formats, dpi, verbose=False):
+    import matplotlib.pyplot as plt
+    import calibration
+
+    start = time.perf_counter()
+    # workers are reused across figures
+    calibration.applied.clear()
+    if profiling.enabled:
+        profiling.reset(name)
+        # until the script's first mark(): its imports
+        profiling.mark("imports")
+    with warnings.catch_warnings(), contextlib.ExitStack() as stack:
+        # plt.show() on the Agg backend only warns
+        warnings.filterwarnings("ignore", message=".*non-interactive.*")
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        try:
+            runpy.run_path(os.path.join(repo_folder, name + ".py"), run_name="__main__")
+        except BaseException:
+            # the worker renders the next figure: drop what this one left open
+            plt.close("all")
+            raise
+
+    outputs = []
+    profiling.mark("save")
+    for i, number in enumerate(plt.get_fignums()):
+        stem = name if i == 0 else f"{name}_{i + 1}"
+        for fmt in formats:
+            path = os.path.join(output_folder, f"{stem}.{fmt}")
+            plt.figure(number).savefig(path, dpi=dpi)
+            outputs.append(path)
+    plt.close("all")
+    if profiling.enabled:
+        profiling.write_report(os.path.join(output_folder, "profile"), name)
+    return name, outputs, time.perf_counter() - start, list(dict.fromkeys(calibration.applied))
+
+
+def build(names, output_folder, formats, dpi=300, jobs=None, verbose=False):
+    output_folder = os.path.abspath(output_folder)
+    os.makedirs(output_folder, exist_ok=True)
+    if not names:
+        return {}
+
+    manifest = read_manifest(output_folder)
+    # inputs are stamped before rendering, so edits made during the build trigger the next one
+    stamps = {name: _input_stamps(figure_inputs(name), manifest.get(name, {}).get("inputs")) for name in names}
+    # the figures use paths relative to the repository: resolved here, the caller's cwd is left alone
+    tables = {(os.path.join(repo_folder, path), 0): read_table(os.path.join(repo_folder, path))
+              for path in shared_tables}
+    jobs = jobs or min(len(names), os.cpu_count() or 1)
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(tables,)) as pool:
+        futures = {pool.submit(render_figure, name, output_folder, formats, dpi, verbose): name for name in names}
+        for future in as_completed(futures):
+            # a failing figure is reported and recorded; the others are still rendered
+            try:
+                name, outputs, elapsed, calibrations = future.result()
+            except Exception as error:
+                name = futures[future]
+                manifest[name] = {"inputs": stamps[name], "settings": figure_settings(name, dpi),
+                                  "formats": list(formats), "outputs": [], "error": f"{type(error).__name__}: {error}"}
+                write_json(os.path.join(output_folder, manifest_name), manifest)
+                print(f"{name}: FAILED, {manifest[name]['error']}", file=sys.stderr)
+                if verbose:
+                    traceback.print_exception(error)
+                continue
+            results[name] = outputs
+            manifest[name] = {"inputs": stamps[name], "settings": figure_settings(name, dpi), "formats": list(formats),
+                              "outputs": [os.path.relpath(path, output_folder) for path in outputs],
+                              "calibrations": calibrations}
+            write_json(os.path.join(output_folder, manifest_name), manifest)
+            print(f"{name}: {len(outputs)} file(s) in {elapsed:.1f} s")
+    return results
+
+
+# poll the inputs and redraw the figures that changed
+def watch(names, output_folder, formats, dpi=300, jobs=None, verbose=False, interval=2.0):
+    print(f"watching {len(names)} figure(s), Ctrl-C to stop")
+    try:
+        while True:
+            # an input being rewritten or removed during the poll is picked up at the next one
+            try:
+                stale = stale_figures(names, output_folder, formats, dpi, retry_failed=False)
+                if stale:
+                    build(stale, output_folder, formats, dpi, jobs, verbose)
+            except OSError as error:
+                print(f"watch: {error}", file=sys.stderr)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the paper figures without opening any window.")
+    parser.add_argument("figures", nargs="*", default=figure_scripts, help="figure scripts to build (default: all)")
+    parser.add_argument("-o", "--output", default=os.path.join(repo_folder, "figures"), help="output folder")
+    parser.add_argument("-f", "--formats", nargs="+", default=["png", "pdf", "svg"], help="output formats")
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per figure, up to the CPU count)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="keep the scripts' own printouts")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the inputs did not change")
+    parser.add_argument("--profile", action="store_true",
+                        help="stage timers and peak memory per figure, written to <output>/profile (same as SERP_PROFILE=1)")
+    parser.add_argument("--watch", nargs="?", type=float, const=2.0, default=None, metavar="SECONDS",
+                        help="keep running and redraw figures when their inputs change")
+    args = parser.parse_args(argv)
+    # relative to where the command was run, for every build and poll
+    args.output = os.path.abspath(args.output)
+
+    if args.profile:
+        os.environ["SERP_PROFILE"] = os.environ.get("SERP_PROFILE") or "1"
+    unknown = [name for name in args.figures if name not in figure_scripts]
+    if unknown:
+        parser.error(f"unknown figure(s): {', '.join(unknown)}")
+
+    if args.watch is not None:
+        if args.force:
+            build(args.figures, args.output, args.formats, args.dpi, args.jobs, args.verbose)
+        watch(args.figures, args.output, args.formats, args.dpi, args.jobs, args.verbose, args.watch)
+        return
+
+    start = time.perf_counter()
+    names = args.figures if args.force else stale_figures(args.figures, args.output, args.formats, args.dpi)
+    if not names:
+        print("figures are up to date")
+        return
+    results = build(names, args.output, args.formats, args.dpi, args.jobs, args.verbose)
+    print(f"done in {time.perf_counter() - start:.1f} s")
+    failed = [name for name in names if name not in results]
+    if failed:
+        print(f"failed: {', '.join(failed)}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import functools
+import hashlib
+import json
+import os
+import pickle
+import sys
+
+# on-disk cache shared by the loaders (spectra, tables, ...)
+cache_folder = os.environ.get("SERP_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+
+# return a path inside the cache, creating the sub-folder if needed
+def cache_path(*parts):
+    path = os.path.join(cache_folder, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+# content hash of a file, read by blocks
+def file_digest(file_path, block_size=1 << 20):
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# short stable key for a source file (used to name its cache entries)
+def path_key(file_path):
+    return hashlib.sha1(os.path.abspath(file_path).encode("utf-8")).hexdigest()
+
+
+# write through a temporary file so that concurrent readers never see a partial entry
+def atomic_write(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+# python/numpy/pandas versions: pickles of DataFrames and arrays are not portable across them
+@functools.lru_cache(maxsize=None)
+def library_versions():
+    import numpy
+    import pandas
+    return f"python {sys.version_info[0]}.{sys.version_info[1]}, numpy {numpy.__version__}, pandas {pandas.__version__}"
+
+
+# intermediate result (medians, normalized spectra...) cached by the content of its input files
+# list the script/modules computing it among the inputs so that code changes invalidate it too
+def cached_result(name, input_files, compute):
+    h = hashlib.sha1(name.encode("utf-8"))
+    h.update(library_versions().encode("utf-8"))
+    for file_path in input_files:
+        h.update(file_digest(file_path).encode("ascii"))
+    path = cache_path("results", f"{name}-{h.hexdigest()}.pkl")
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        # unreadable entry (truncated, or pickled by other library versions): computed again
+        pass
+
+    result = compute()
+
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    atomic_write(path, write)
+    return result
+
+
+def read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, obj):
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(obj, f)
+    atomic_write(path, write)
@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from cache import atomic_write
+from oxides import numeric_block
+
+# named, versioned factor sets (one JSON list shared by every script)
+registry_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calibrations.json")
+# calibration applied to the pXRF data of the paper, pinned to its version: registering a new
+# version of the set does not change the published figures
+default_calibration = "pxrf-crete@1"
+# labels of the calibrations applied in this process, in order (read back by build.py)
+applied = []
+
+
+def load_registry(path=registry_file):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_registry(registry, path=registry_file):
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(registry, f, indent=1)
+    atomic_write(path, write)
+
+
+def calibration_label(calibration):
+    return f"{calibration['name']} v{calibration['version']}"
+
+
+# latest version of a named set, or the given version; "name@2" is accepted as well
+def get_calibration(name, version=None, path=registry_file):
+    if version is None and "@" in name:
+        name, version = name.split("@")
+    matches = [c for c in load_registry(path) if c["name"] == name
+               and (version is None or c["version"] == int(version))]
+    if not matches:
+        raise KeyError(f"no calibration {name!r}" + (f" version {version}" if version is not None else ""))
+    return max(matches, key=lambda c: c["version"])
+
+
+# store a factor set as the next version of `name`
+def register(name, factors, instrument=None, campaign=None, notes=None, path=registry_file):
+    registry = load_registry(path)
+    version = 1 + max((c["version"] for c in registry if c["name"] == name), default=0)
+    calibration = {"name": name, "version": version, "instrument": instrument, "campaign": campaign,
+                   "factors": {column: float(factor) for column, factor in factors.items()}, "notes": notes}
+    registry.append(calibration)
+    save_registry(registry, path)
+    return calibration
+
+
+# factor per column from reference materials: least squares through the origin of the certified
+# values against the measured ones. measured: readings (repeated readings allowed) and certified:
+# one row per material, both with the material name in `id_column`.
+def fit_factors(measured, certified, columns, id_column="Sample ID"):
+    measured = measured.groupby(id_column)[list(columns)].median()
+    certified = certified.set_index(id_column).reindex(measured.index)
+    m = numeric_block(measured, list(columns))
+    c = numeric_block(certified, list(columns))
+    valid = np.isfinite(m) & np.isfinite(c)
+    m, c = np.where(valid, m, 0), np.where(valid, c, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factors = (c * m).sum(axis=0) / (m * m).sum(axis=0)
+    return {column: factor for column, factor in zip(columns, factors) if np.isfinite(factor)}
+
+
+# scale the calibrated columns of df in place, as one block operation (no copy of the frame).
+# The label of the calibration is appended to df.attrs["calibrations"] and to `applied`.
+def apply_calibration(df, calibration=default_calibration):
+    if isinstance(calibration, str):
+        calibration = get_calibration(calibration)
+    columns = [column for column in calibration["factors"] if column in df.columns]
+    factors = np.array([calibration["factors"][column] for column in columns])
+    values = numeric_block(df, columns, dtype=None)
+    df[columns] = values * factors.astype(values.dtype)
+    label = calibration_label(calibration)
+    df.attrs["calibrations"] = df.attrs.get("calibrations", []) + [label]
+    applied.append(label)
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List calibrations, or fit one from reference materials.")
+    parser.add_argument("--fit", nargs=2, metavar=("MEASURED", "CERTIFIED"),
+                        help="tables (.csv/.xlsx) of reference-material readings and certified values")
+    parser.add_argument("--name", help="name of the fitted calibration")
+    parser.add_argument("--instrument")
+    parser.add_argument("--campaign")
+    parser.add_argument("--columns", nargs="+", default=["SiO2", "CaO", "Al2O3", "MgO", "Ni"])
+    args = parser.parse_args(argv)
+
+    if args.fit:
+        if not args.name:
+            parser.error("--fit needs --name")
+        measured, certified = [pd.read_excel(path) if path.lower().endswith((".xlsx", ".xls")) else pd.read_csv(path)
+                               for path in args.fit]
+        factors = fit_factors(measured, certified, args.columns)
+        calibration = register(args.name, factors, args.instrument, args.campaign,
+                               notes=f"fitted from {os.path.basename(args.fit[0])}")
+        print(f"registered {calibration_label(calibration)}")
+
+    for calibration in load_registry():
+        factors = ", ".join(f"{column} {factor:g}" for column, factor in calibration["factors"].items())
+        print(f"{calibration_label(calibration)} ({calibration['instrument']}, {calibration['campaign']}): {factors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import argparse
+import json
+import warnings
+import numpy as np
+import pandas as pd
+
+from colours import hex_to_colour_table
+from calibration import apply_calibration
+from oxides import load_pxrf_oxides
+from tables import file_munsell, file_pms, read_table
+
+# heat treatment of each category used in the workbooks (red serpentinite = heated blue serpentinite)
+heated_labels = {
+    "Blue vases": False, "Red vases": True, "Blue vase": False, "Red vase": True,
+    "Unheated sample": False, "Heated sample": True,
+}
+# pXRF facies of the archaeological vases: 1 = blue, 6 = red serpentinite
+heated_facies = {1: False, 6: True}
+
+geochemistry_features = ["MgO/SiO2", "Al2O3", "CaO", "Fe2O3T", "Ni"]
+pms_features = ["SI"]
+colour_features = ["Hue", "Saturation", "Value"]
+# heat-state model: only what heating changes. The geochemistry is one value per object, shared by its
+# heated and unheated rows: it cannot tell the two states of a sample apart, and on the vases it would
+# only learn which objects are red (their facies), so it is left out unless asked for (--geochemistry)
+default_features = pms_features + colour_features
+# rows with fewer measured features are not used for fitting and get no probability (NaN)
+min_features = 1
+
+
+# one row per (Sample ID, Heated): median SI (pMS) and colour (Munsell) of that state, and the
+# median geochemistry of the object (pXRF; joined on Sample ID, so both states get the same values)
+def feature_table():
+    pms = read_table(file_pms, columns=["Sample ID", "vase_type", "SI"])
+    pms["Heated"] = pms["vase_type"].map(heated_labels)
+    pms = pms.dropna(subset=["Heated"]).groupby(["Sample ID", "Heated"])["SI"].median()
+
+    munsell = read_table(file_munsell, columns=["Sample ID", "Type", "Hex"])
+    munsell["Heated"] = munsell["Type"].map(heated_labels)
+    munsell = munsell.dropna(subset=["Heated"]).join(hex_to_colour_table(munsell["Hex"]))
+    munsell = munsell.groupby(["Sample ID", "Heated"])[colour_features].median()
+
+    df = pd.concat([pms, munsell], axis=1).reset_index()
+    df["Heated"] = df["Heated"].astype(bool)
+
+    pxrf = apply_calibration(load_pxrf_oxides())
+    geochemistry = pxrf.groupby("Sample ID")[geochemistry_features].median()
+    # vases only analysed by pXRF: their facies gives the label
+    facies = pxrf.dropna(subset=["Facies"]).groupby("Sample ID")["Facies"].first().map(heated_facies).dropna()
+    missing = facies.index.difference(df["Sample ID"])
+    df = pd.concat([df, pd.DataFrame({"Sample ID": missing, "Heated": facies[missing].astype(bool).to_numpy()})],
+                   ignore_index=True)
+    return df.join(geochemistry, on="Sample ID")[["Sample ID", "Heated"] + geochemistry_features + pms_features
+                                                 + colour_features]
+
+
+# a table to score without any of the features is an error, one without some of them a warning
+# (they are imputed); called by the public functions, so that the warning points at their caller
+def _check_features(df, features):
+    missing = [feature for feature in features if feature not in df.columns]
+    if len(missing) == len(features):
+        raise KeyError(f"none of the model features {features} in the table")
+    if missing:
+        warnings.warn(f"no {missing} column: imputed with the training medians for every row", stacklevel=3)
+
+
+# hue is circular: red and blue serpentinites sit on either side of 0 degrees, so it is wrapped to (-180, 180]
+def _feature_values(df, features):
+    values = df.reindex(columns=features).apply(pd.to_numeric, errors="coerce")
+    if "Hue" in values:
+        values["Hue"] = 180 - (180 - values["Hue"]) % 360
+    return values
+
+
+# standardized design matrix and the number of imputed features of every row
+def _design(df, model):
+    matrix = _feature_values(df, model["features"]).to_numpy(dtype=float)
+    measured = np.isfinite(matrix)
+    matrix = np.where(measured, matrix, np.asarray(model["medians"]))
+    return (matrix - np.asarray(model["mean"])) / np.asarray(model["std"]), (~measured).sum(axis=1)
+
+
+# rows of a training table with at least `min_features` of the features (those measured at all)
+def _training_rows(df, features):
+    features = [feature for feature in features if df[feature].notna().any()]
+    return df[df[features].notna().sum(axis=1) >= min(min_features, len(features))], features
+
+
+# L2-regularized logistic regression fitted by Newton iterations, on the rows with at least `min_features`
+# measured features; the missing ones are imputed with the training medians.
+# The model is a plain dict (JSON-serializable).
+def fit(df, features=default_features, label="Heated", l2=1.0, n_iter=50):
+    df, features = _training_rows(df, features)
+    raw = _feature_values(df, features)
+    model = {"features": features, "medians": raw.median().tolist()}
+    filled = raw.fillna(raw.median())
+    model["mean"] = filled.mean().tolist()
+    model["std"] = filled.std(ddof=0).replace(0, 1).tolist()
+
+    x = np.column_stack([np.ones(len(df)), _design(df, model)[0]])
+    y = df[label].to_numpy(dtype=float)
+    penalty = l2 * np.eye(x.shape[1])
+    penalty[0, 0] = 0
+    w = np.zeros(x.shape[1])
+    for _ in range(n_iter):
+        p = 1 / (1 + np.exp(-x @ w))
+        gradient = x.T @ (p - y) + penalty @ w
+        hessian = (x * (p * (1 - p))[:, None]).T @ x + penalty
+        step = np.linalg.solve(hessian, gradient)
+        w -= step
+        if np.abs(step).max() < 1e-8:
+            break
+    model["intercept"] = float(w[0])
+    model["coefficients"] = w[1:].tolist()
+    return model
+
+
+def _probabilities(df, model):
+    design, imputed = _design(df, model)
+    z = design @ np.asarray(model["coefficients"]) + model["intercept"]
+    n_features = len(model["features"])
+    proba = np.where(n_features - imputed >= min(min_features, n_features), 1 / (1 + np.exp(-z)), np.nan)
+    return proba, imputed
+
+
+# probability of heat treatment for every row of a table (any subset of the features), in one matrix product
+# rows with fewer than `min_features` measured features get NaN
+def predict_proba(df, model, return_imputed=False):
+    _check_features(df, model["features"])
+    proba, imputed = _probabilities(df, model)
+    return (proba, imputed) if return_imputed else proba
+
+
+# unscored rows (too few features) are not predicted heated
+def predict(df, model, threshold=0.5):
+    _check_features(df, model["features"])
+    return _probabilities(df, model)[0] >= threshold
+
+
+def save_model(model, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(model, f, indent=1)
+
+
+def load_model(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# leave-one-object-out accuracy (both states of an experimental sample are left out together)
+# on the rows with enough measured features
+def cross_validate(df, features=default_features, label="Heated", **fit_options):
+    df = _training_rows(df, features)[0]
+    predicted = np.zeros(len(df), dtype=bool)
+    for sample_id in df["Sample ID"].unique():
+        test = (df["Sample ID"] == sample_id).to_numpy()
+        model = fit(df[~test], features, label, **fit_options)
+        predicted[test] = predict(df[test], model)
+    return float((predicted == df[label].to_numpy(dtype=bool)).mean())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Heat-treatment classifier from pXRF, pMS and colour features.")
+    parser.add_argument("--model", default="heat_classifier.json", help="model file (written by --train)")
+    parser.add_argument("--train", action="store_true", help="fit on the supplementary data and save the model")
+    parser.add_argument("--geochemistry", action="store_true",
+                        help="also fit on the pXRF geochemistry (shared by both states of an object, see above)")
+    parser.add_argument("--score", metavar="TABLE", help="score a field export (.csv/.xlsx with feature columns)")
+    parser.add_argument("-o", "--output", help="write the scored table (.csv or .xlsx)")
+    args = parser.parse_args(argv)
+
+    if args.train:
+        features = geochemistry_features + default_features if args.geochemistry else default_features
+        df = _training_rows(feature_table(), features)[0]
+        model = fit(df, features)
+        save_model(model, args.model)
+        print(f"{len(df)} rows, leave-one-object-out accuracy {cross_validate(df, features):.2f}, "
+              f"model -> {args.model}")
+        print(pd.Series(model["coefficients"], index=model["features"], name="coefficient").round(2).to_string())
+
+    if args.score:
+        model = load_model(args.model)
+        reader = pd.read_excel if args.score.lower().endswith((".xlsx", ".xls")) else pd.read_csv
+        df = reader(args.score)
+        df["P(heated)"], df["Imputed features"] = predict_proba(df, model, return_imputed=True)
+        if not args.output:
+            print(df)
+        elif args.output.lower().endswith(".csv"):
+            df.to_csv(args.output, index=False)
+        else:
+            df.to_excel(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
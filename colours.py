@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+# skimage (slow to import) is only loaded by the colour space conversions
+
+# value of each ASCII code as a hexadecimal digit (-1 if not a digit)
+_hex_digits = np.full(256, -1, dtype=np.int16)
+for _i, _c in enumerate("0123456789abcdef"):
+    _hex_digits[ord(_c)] = _i
+    _hex_digits[ord(_c.upper())] = _i
+
+
+# "#rrggbb" strings -> (n, 3) RGB array in [0, 1], decoded all at once
+def hex_to_rgb(hex_colors):
+    values = np.char.lstrip(np.asarray(hex_colors, dtype=str), "#")
+    if values.size and not (np.char.str_len(values) == 6).all():
+        raise ValueError("hex colours must have 6 digits (#rrggbb)")
+    codes = np.frombuffer("".join(values.ravel()).encode("ascii"), dtype=np.uint8).reshape(-1, 3, 2)
+    digits = _hex_digits[codes]
+    if (digits < 0).any():
+        raise ValueError("invalid hexadecimal digit in colour")
+    return (digits[..., 0] * 16 + digits[..., 1]) / 255.0
+
+
+# (..., 3) RGB arrays -> HSV in [0, 1] (hue as a fraction of the turn)
+def rgb_to_hsv(rgb):
+    from skimage import color
+
+    return color.rgb2hsv(np.asarray(rgb, dtype=float), channel_axis=-1)
+
+
+# (..., 3) sRGB arrays -> CIELAB (D65)
+def rgb_to_lab(rgb):
+    from skimage import color
+
+    return color.rgb2lab(np.asarray(rgb, dtype=float), channel_axis=-1)
+
+
+# columns used by fig10 (Hue in degrees, Saturation, Value) plus CIELAB, for a column of hex colours
+def hex_to_colour_table(hex_colors, index=None):
+    rgb = hex_to_rgb(hex_colors)
+    hsv = rgb_to_hsv(rgb)
+    lab = rgb_to_lab(rgb)
+    if index is None and isinstance(hex_colors, pd.Series):
+        index = hex_colors.index
+    return pd.DataFrame({"Hue": hsv[:, 0] * 360, "Saturation": hsv[:, 1], "Value": hsv[:, 2],
+                         "L*": lab[:, 0], "a*": lab[:, 1], "b*": lab[:, 2]}, index=index)
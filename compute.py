@@ -0,0 +1,95 @@
+import argparse
+import os
+import sys
+
+# headless entry point for the data products (no plotting stack): every command imports only what it
+# needs, so that a batch scheduler calling it once per file does not pay for matplotlib, seaborn or skimage
+
+
+def _write(df, output, index=True):
+    if output is None:
+        df.to_csv(sys.stdout, index=index)
+    elif output.lower().endswith((".xlsx", ".xls")):
+        df.to_excel(output, index=index)
+    else:
+        df.to_csv(output, index=index)
+
+
+# pXRF readings converted to oxides, calibrated unless --calibration none
+def export_oxides(args):
+    from calibration import apply_calibration, default_calibration
+    from oxides import load_pxrf_oxides
+
+    df = load_pxrf_oxides()
+    calibration = args.calibration or default_calibration
+    if calibration != "none":
+        apply_calibration(df, calibration)
+    _write(df, args.output, index=False)
+
+
+# per-sample medians: pXRF oxides (calibrated) or pMS magnetic susceptibility
+def export_medians(args):
+    if args.instrument == "pms":
+        from stats import pms_medians
+
+        _write(pms_medians(["Blue vases", "Red vases", "Unheated sample", "Heated sample"]), args.output, index=False)
+        return
+
+    from calibration import apply_calibration, default_calibration
+    from oxides import load_pxrf_oxides, major_oxides
+
+    df = load_pxrf_oxides()
+    calibration = args.calibration or default_calibration
+    if calibration != "none":
+        apply_calibration(df, calibration)
+    columns = major_oxides + ["Ni", "MgO/SiO2"]
+    medians = df.groupby(["Type", "Facies", "Sample ID"], dropna=False)[columns].median()
+    _write(medians.reset_index(), args.output, index=False)
+
+
+# phase tables: XRD peak indexing or Raman reference matching
+def export_phases(args):
+    import glob
+
+    if args.method == "xrd":
+        from xrd import analyse_files, xrd_folder
+
+        files = args.files or sorted(glob.glob(os.path.join(xrd_folder, "*.txt")))
+        _, presence, relative_intensity = analyse_files(files, tolerance=args.tolerance)
+        table = relative_intensity.where(presence)
+    else:
+        from raman import identify_files, raman_folder
+
+        files = args.files or sorted(glob.glob(os.path.join(raman_folder, "*.txt")))
+        table = identify_files(files, clean=args.clean)
+    _write(table, args.output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute the data products of the figures without plotting.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    oxides = commands.add_parser("oxides", help="pXRF readings as oxides")
+    oxides.add_argument("--calibration", help="calibration name (default: the paper's), 'none' to skip")
+    oxides.set_defaults(run=export_oxides)
+
+    medians = commands.add_parser("medians", help="per-sample medians")
+    medians.add_argument("instrument", choices=["pxrf", "pms"])
+    medians.add_argument("--calibration", help="pXRF calibration name (default: the paper's), 'none' to skip")
+    medians.set_defaults(run=export_medians)
+
+    phases = commands.add_parser("phases", help="phase tables from XRD patterns or Raman spectra")
+    phases.add_argument("method", choices=["xrd", "raman"])
+    phases.add_argument("files", nargs="*", help="spectra (default: the supplementary data)")
+    phases.add_argument("--tolerance", type=float, default=0.3, help="XRD peak matching tolerance (° 2θ)")
+    phases.add_argument("--clean", action="store_true", help="Raman: remove spikes, smooth and subtract the baseline")
+    phases.set_defaults(run=export_phases)
+
+    for command in (oxides, medians, phases):
+        command.add_argument("-o", "--output", help="output table (.csv or .xlsx, default: CSV on stdout)")
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import numpy as np
+
+
+# bin edges over the finite values of x, log-spaced for axes drawn in log scale
+def bin_edges(values, bins=150, log=False, value_range=None):
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values) & (values > 0)] if log else values[np.isfinite(values)]
+    if value_range is None:
+        value_range = (values.min(), values.max()) if values.size else (0.0, 1.0)
+    low, high = value_range
+    if high <= low:
+        high = low + (abs(low) if low else 1.0) * 1e-3
+    return np.geomspace(low, high, bins + 1) if log else np.linspace(low, high, bins + 1)
+
+
+# 2D histogram of a reference compilation for one (x, y) pair: (counts[x, y], x_edges, y_edges)
+def density_grid(x, y, bins=150, x_log=False, y_log=False, x_range=None, y_range=None):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    x_edges = bin_edges(x, bins, x_log, x_range)
+    y_edges = bin_edges(y, bins, y_log, y_range)
+    counts, _, _ = np.histogram2d(x, y, bins=[x_edges, y_edges])
+    return counts, x_edges, y_edges
+
+
+# density grids for several (x, y) column pairs of a table; log_columns are binned logarithmically
+def density_grids(df, pairs, bins=150, log_columns=()):
+    return {(x, y): density_grid(df[x], df[y], bins, x in log_columns, y in log_columns) for x, y in pairs}
+
+
+# draw a grid as a single raster image (empty bins transparent), whatever the number of points behind it
+def draw_density(ax, counts, x_edges, y_edges, cmap="Greys", alpha=1.0, zorder=0):
+    from matplotlib.colors import LogNorm
+
+    counts = np.ma.masked_equal(counts.T, 0)
+    if counts.count() == 0:
+        return None
+    return ax.pcolormesh(x_edges, y_edges, counts, cmap=cmap, norm=LogNorm(vmin=1, vmax=counts.max()),
+                         alpha=alpha, shading="flat", rasterized=True, zorder=zorder, linewidth=0)
@@ -1,87 +1,89 @@
+import os
+import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
+import density
+import oxides
+import tables
 from matplotlib.colors import ListedColormap
-
-def conv_elem_to_oxides(df):
-    # Mg#
-    if 'Mg' in df.columns and 'Fe' in df.columns:
-        df['Mg#'] = df['Mg'] / (df['Mg'] + df['Fe'])
-
-    # Convertir les éléments en oxydes
-    for column in df.columns:
-        if column in list_oxides:
-            conv_oxide_factor = conv_oxides.query("Element == @column")['Factor']
-            oxide_name = conv_oxides.query("Element == @column")['Oxide'].iloc[0]
-            if not df[column].empty:
-                df[column] = pd.to_numeric(df[column], errors='coerce')
-                df[oxide_name] = df[column] / conv_oxide_factor.iloc[0] / 10000
-            del df[column]
-
-    df['Sum_of_oxydes_before_normalization'] = df[['MgO', 'Al2O3', 'SiO2', 'K2O', 'CaO', 'MnO', 'Fe2O3T']].sum(axis=1)
-    df['MgOSiO2'] = df['MgO'] / df['SiO2']
-    return df
-
-
-# Apply calibration corrections
-def accuracy_calib(df):
-    df_corrected = df.copy()
-    df_corrected['SiO2'] *= 0.87
-    df_corrected['CaO'] *= 0.90
-    df_corrected['Al2O3'] *= 0.87
-    df_corrected['MgO'] *= 0.92
-    df_corrected['Ni'] *= 0.89
-    return df_corrected
-
-
-
-# Load data from file (replace with your actual path)
-file_path_data_crete = r"./Suppl data/Tabular data/suppl data pXRF.xlsx"
-file_conv_oxide = r'./Suppl data/Tabular data/conv_oxides.xlsx'
-list_oxides = ['Al','Ca','Fe','K','Mg','Mn','Si','Ti']
-conv_oxides = pd.read_excel(file_conv_oxide)
-df_crete = pd.read_excel(file_path_data_crete)
-
-df_crete = conv_elem_to_oxides(df_crete)
-df_crete['MgO/SiO2'] = df_crete['MgO'] / df_crete['SiO2']
-df_crete.to_excel("test.xlsx")
-
-df_crete = accuracy_calib(df_crete)
-df_heating = df_crete[df_crete['Type'] == "Experimental heating"]
+from cache import cached_result
+from density import density_grids, draw_density
+from ingest import ReadingStore, use_store
+from calibration import apply_calibration
+from oxides import load_pxrf_oxides, load_world_serp
+from profiling import mark
+from tables import file_conv_oxides, file_deschamps, file_pxrf
+
+# pXRF analyses with the archaeological facies 1 and 6 first, then the experimental heating:
+# both groups are then row slices of the table (views, no copy)
+def load_crete():
+    df = load_pxrf_oxides(typed=True)
+    heating = (df['Type'] == "Experimental heating").to_numpy()
+    facies = ~heating & df['Facies'].isin([1, 6]).to_numpy()
+    return df.iloc[np.argsort(np.where(facies, 0, np.where(heating, 1, 2)), kind="stable")]
+
+
+# Load data (only the columns used below; categorical labels, float32 measurements)
+mark("load")
+df_crete = cached_result("fig06_crete", [file_pxrf, file_conv_oxides, __file__, oxides.__file__, tables.__file__],
+                         load_crete)
+# Worldwide serpentinite data, normalized and typed by blocks of rows (large compilations)
+df_world_serp = cached_result("fig06_world_serp", [file_deschamps, __file__, oxides.__file__, tables.__file__],
+                              lambda: load_world_serp(typed=True, chunk_rows=100_000))
+
+mark("transform")
+df_crete = apply_calibration(df_crete)
+print("Calibration:", ", ".join(df_crete.attrs["calibrations"]))
+# Filter for facies 1 and 6, and the experimental heating: slices of the table (see load_crete)
+n_facies = int((df_crete['Type'].ne("Experimental heating") & df_crete['Facies'].isin([1, 6])).sum())
+n_heating = int(df_crete['Type'].eq("Experimental heating").sum())
+df_facies = df_crete.iloc[:n_facies]
+df_heating = df_crete.iloc[n_facies:n_facies + n_heating]
 print(df_heating)
-df_archeo = df_crete[df_crete['Type'] != "Experimental heating"].copy()
-
-
-# Load worldwide serpentinite data
-file_path_data_compil_serp = r"./Suppl data/Tabular data/suppl data Deschamps 2013 compil.xlsx"
-df_world_serp = pd.read_excel(file_path_data_compil_serp)
-df_world_serp['ratio_normalised'] = 100 / df_world_serp['Total']
-columns_to_multiply = ['SiO2', 'TiO2', 'Al2O3', 'Cr2O3', 'Fe2O3T', 'MnO', 'NiO', 'MgO', 'CaO', 'Na2O', 'K2O', 'P2O5']
-for col in columns_to_multiply:
-    if pd.api.types.is_numeric_dtype(df_world_serp[col]):
-        df_world_serp[col] *= df_world_serp['ratio_normalised']
-    else:
-        df_world_serp[col] = pd.to_numeric(df_world_serp[col], errors='coerce')
-
-df_world_serp['MgO/SiO2'] = df_world_serp['MgO'] / df_world_serp["SiO2"]
-required_columns = ["MgO/SiO2", "SiO2", "CaO", "TiO2", "Ni", "MgO"]
-df_world_serp[required_columns] = df_world_serp[required_columns].apply(pd.to_numeric, errors='coerce')
-
-
-# Filter for facies 1 and 6
-df_facies = df_archeo[df_archeo['Facies'].isin([1, 6])]
-df_facies_1 = df_archeo[df_archeo['Facies'] == 1]
-df_facies_6 = df_archeo[df_archeo['Facies'] == 6]
 
 # Plotting
 axes_pairs = [("MgO","SiO2"), ("Al2O3", "MgO/SiO2"), ("CaO", "MgO/SiO2"), ("Ni", "MgO/SiO2")]
+plotted_columns = list(dict.fromkeys(column for pair in axes_pairs for column in pair))
+
+# Per-sample aggregates of every plotted variable, computed once for all subplots
+mark("aggregate")
+if use_store:
+    # running aggregates of the reading store (SERP_STORE), no rescan of the readings
+    store = ReadingStore()
+    store_stats = {stat: apply_calibration(store.statistic("pxrf", stat)) for stat in ['median', 'min', 'max']}
+    df_medians = store_stats['median']
+    df_medians = df_medians[(df_medians['Type'] != "Experimental heating") & df_medians['Facies'].isin([1, 6])]
+    df_medians = df_medians.sort_values(['Sample ID', 'Facies'])[['Sample ID', 'Facies'] + plotted_columns]
+    df_heating_stats = pd.concat(
+        {stat: df[df['Type'] == "Experimental heating"].set_index('Sample ID')[plotted_columns].sort_index()
+         for stat, df in store_stats.items()}, axis=1).swaplevel(axis=1)
+else:
+    df_medians = df_facies.groupby(['Sample ID', 'Facies'], observed=True)[plotted_columns].median().reset_index()
+    df_heating_stats = df_heating.groupby(['Sample ID'], observed=True)[plotted_columns].agg(['median', 'min', 'max'])
+df_heating_medians = df_heating_stats.xs('median', axis=1, level=1)
+df_heating_err_low = df_heating_medians - df_heating_stats.xs('min', axis=1, level=1)
+df_heating_err_high = df_heating_stats.xs('max', axis=1, level=1) - df_heating_medians
+df_heating_medians = df_heating_medians.reset_index()
+
+# Worldwide serpentinite background: "scatter" (one point per analysis) or "density"
+# (precomputed 2D histogram drawn as one raster image, for large compilations)
+background_mode = os.environ.get("FIG06_BACKGROUND", "scatter")
+if background_mode == "density":
+    world_serp_density = cached_result(
+        "fig06_world_serp_density", [file_deschamps, __file__, oxides.__file__, tables.__file__, density.__file__],
+        lambda: density_grids(df_world_serp, [(axe_x, axe_y) for axe_y, axe_x in axes_pairs], log_columns=["CaO"]))
+
+mark("render")
 fig, axes = plt.subplots(2, 2, figsize=(10, 10))  # Square graphs
 n = 0
 n_list = ['a', 'b', 'c', 'd']
 
 for ax, (axe_y, axe_x) in zip(axes.flat, axes_pairs):
     cmap = ListedColormap(sns.color_palette("Greys", n_colors=256)[100:])
-    if axe_y == "TiO2" or axe_x in ["Cr", "Zn"]:
+    if background_mode == "density":
+        draw_density(ax, *world_serp_density[(axe_x, axe_y)], cmap=cmap, alpha=0.6)
+    elif axe_y == "TiO2" or axe_x in ["Cr", "Zn"]:
         df_world_serp_filtered = df_world_serp.dropna(subset=[axe_x if axe_x in df_world_serp else axe_y])
         sns.scatterplot(data=df_world_serp_filtered, x=axe_x, y=axe_y, color="grey",
                         marker='o', legend=False, alpha=0.1, ax=ax)
@@ -89,8 +91,6 @@ for ax, (axe_y, axe_x) in zip(axes.flat, axes_pairs):
         sns.scatterplot(data=df_world_serp, x=axe_x, y=axe_y, color="grey",
                         marker='o', legend=False, alpha=0.1, ax=ax)
 
-    df_medians = df_facies.groupby(['Sample ID', 'Facies'])[[axe_x, axe_y]].median().reset_index()
-
     sns.scatterplot(data=df_facies, x=axe_x, y=axe_y, hue='Facies', palette={1: 'blue', 6: 'red'},
                     edgecolor='black', marker='o', facecolor='none', legend=False, alpha=0.1, ax=ax)
     sns.scatterplot(data=df_medians, x=axe_x, y=axe_y, hue='Facies', palette={1: 'blue', 6: 'red'},
@@ -98,18 +98,13 @@ for ax, (axe_y, axe_x) in zip(axes.flat, axes_pairs):
 
 
 
-    df_heating_medians = df_heating.groupby(['Sample ID'])[[axe_x, axe_y]].median().reset_index()
-    df_heating_min = df_heating.groupby(['Sample ID'])[[axe_x, axe_y]].min().reset_index()
-    df_heating_max = df_heating.groupby(['Sample ID'])[[axe_x, axe_y]].max().reset_index()
     sns.scatterplot(data=df_heating_medians, x=axe_x, y=axe_y, color="gold",
                     edgecolor='black', marker='s', legend=False, ax=ax)
-    for i, row in df_heating_medians.iterrows():
-        min_value = df_heating_min.loc[i, [axe_x, axe_y]].values
-        max_value = df_heating_max.loc[i, [axe_x, axe_y]].values
-        ax.errorbar(x=row[axe_x], y=row[axe_y],
-                    xerr=[[row[axe_x] - min_value[0]], [max_value[0] - row[axe_x]]],
-                    yerr=[[row[axe_y] - min_value[1]], [max_value[1] - row[axe_y]]],
-                    fmt='o', color='black', capsize=5, elinewidth=0.5, alpha=0.5)
+    # min-max error bars of all heated samples in one call
+    ax.errorbar(x=df_heating_medians[axe_x], y=df_heating_medians[axe_y],
+                xerr=[df_heating_err_low[axe_x], df_heating_err_high[axe_x]],
+                yerr=[df_heating_err_low[axe_y], df_heating_err_high[axe_y]],
+                fmt='o', color='black', capsize=5, elinewidth=0.5, alpha=0.5)
 
     # Axis labels and customizations
     # Axis labels and customizations
@@ -146,6 +141,7 @@ legend_elements = [
 axes[1, 1].legend(handles=legend_elements, loc='upper right', fontsize=12)
 # Annoter les Sample ID pour les points archéologiques (médianes)
 
+mark("layout")
 plt.subplots_adjust(wspace=0.5)
 # Final layout adjustment and display
 plt.tight_layout()
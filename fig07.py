@@ -2,14 +2,19 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
+from cache import cached_result
+from ingest import store_pms_medians, use_store
+from profiling import mark
+import stats
+from stats import pms_medians
+from tables import file_pms
 
-# Load data
-file_path_archeo = r"./Suppl data/Tabular data/suppl data pMS.xlsx"
-df_archeo = pd.read_excel(file_path_archeo)
 
-# Filter and process archaeological data
-df_filtered = df_archeo[df_archeo["vase_type"].isin(["Blue vases", "Red vases"])][["Sample ID", "vase_type", "SI"]]
-df_median = df_filtered.groupby(["vase_type", "Sample ID"], as_index=False)["SI"].median()
+mark("aggregate")
+if use_store:
+    df_median = store_pms_medians()
+else:
+    df_median = cached_result("fig07_medians", [file_pms, __file__, stats.__file__], pms_medians)
 df_filtered = df_median.copy()
 df_filtered['vase_type'] = pd.Categorical(
     df_filtered['vase_type'],
@@ -22,6 +27,7 @@ palette = {
 }
 
 # Set up figure and axis
+mark("render")
 fig, ax1 = plt.subplots(figsize=(6, 6))
 
 # Boxplot
@@ -37,5 +43,6 @@ ax1.legend(handles, labels, title_fontsize=14, fontsize=12, loc='upper right')
 ax1.set_ylabel(r'Magnetic susc. (SI ×10$^3$)', fontsize=14)
 ax1.tick_params(axis='both', labelsize=12)
 # Layout
+mark("layout")
 plt.tight_layout()
 plt.show()
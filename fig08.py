@@ -1,12 +1,17 @@
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
+from ingest import store_pms_medians, use_store
+from profiling import mark
+from stats import si_bands
+from tables import file_pms, read_table
 
 # Load the dataset
-file_path = r"./Suppl data/Tabular data/suppl data pMS.xlsx"
-df = pd.read_excel(file_path)
+mark("load")
+df = read_table(file_pms, columns=["Sample ID", "vase_type", "SI"])
 print(df)
 # Filter only heated and unheated samples with necessary columns
+mark("transform")
 df_heating_sample = df[df["vase_type"].isin(["Heated sample", "Unheated sample"])][["Sample ID", "vase_type", "SI"]]
 print(df_heating_sample)
 # Define color palette for both categories
@@ -26,6 +31,7 @@ df_heating_sample['vase_type'] = pd.Categorical(
 df_heating_sample['Sample ID'] = pd.Categorical(df_heating_sample['Sample ID'], ordered=True)
 
 # Create the plot with square aspect ratio
+mark("render")
 plt.figure(figsize=(10, 10))
 ax = sns.boxplot(
     data=df_heating_sample,
@@ -37,11 +43,10 @@ ax = sns.boxplot(
     flierprops=dict(marker='d', markerfacecolor='grey', alpha=0.5)
 )
 
-# Define reference min-max ranges for blue and red vases
-blue_min = 25.93315
-blue_max = 86.432
-red_min = 4.3969
-red_max = 16.9569
+# Reference min-max ranges of the per-vase median SI of the blue and red vases
+mark("aggregate")
+(blue_min, blue_max), (red_min, red_max) = si_bands(store_pms_medians() if use_store else None)
+mark("render")
 
 # Add shaded reference ranges (min-max bands)
 ax.axhspan(blue_min, blue_max, color='#3273FF', alpha=0.2, label='Blue vases min-max')
@@ -82,5 +87,6 @@ plt.xticks(fontsize=15)
 plt.yticks(fontsize=15)
 
 # Final layout adjustment and display
+mark("layout")
 plt.tight_layout()
 plt.show()
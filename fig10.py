@@ -1,26 +1,18 @@
-import pandas as pd
-import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-from skimage import color
 from adjustText import adjust_text
 from matplotlib.lines import Line2D
+from colours import hex_to_colour_table
+from profiling import mark
+from tables import file_munsell, read_table
 
 # Download data
-file_path_archeo = r"./Suppl data/Tabular data/suppl data Munsell.xlsx"
-df = pd.read_excel(file_path_archeo)
+mark("load")
+df = read_table(file_munsell, columns=["Sample ID", "Type", "Hex"])
 
-# Conversion HEX -> HSV
-def hex_to_hsv(hex_color):
-    hex_color = hex_color.lstrip("#")
-    rgb = np.array([int(hex_color[i:i+2], 16) / 255.0 for i in (0, 2, 4)])
-    hsv = color.rgb2hsv(rgb.reshape(1, 1, 3))[0, 0]
-    return hsv
-
-df["HSV"] = df["Hex"].apply(hex_to_hsv)
-df["Hue"] = df["HSV"].apply(lambda x: x[0] * 360)
-df["Saturation"] = df["HSV"].apply(lambda x: x[1])
-df["Value"] = df["HSV"].apply(lambda x: x[2])
+# Conversion HEX -> HSV (and CIELAB) for the whole column at once
+mark("transform")
+df = df.join(hex_to_colour_table(df["Hex"]))
 
 # Style de points et couleurs
 marker_dict = {
@@ -37,6 +29,7 @@ color_dict = {
 }
 
 # Figure division
+mark("render")
 fig, axes = plt.subplots(1, 2, figsize=(20, 10))
 
 texts_hue_sat = []
@@ -75,10 +68,12 @@ axes[1].tick_params(axis='both', labelsize=20)
 axes[1].grid(linewidth=0.7)
 
 # Text
+mark("label placement")
 adjust_text(texts_hue_sat, ax=axes[0], expand=(1.2, 1.2), arrowprops=dict(arrowstyle="-", lw=0.8))
 adjust_text(texts_hue_val, ax=axes[1], expand=(1.2, 1.2), arrowprops=dict(arrowstyle="-", lw=0.8))
 
 # Legend
+mark("render")
 legend_elements = [
     Line2D([0], [0], marker='X', color='w', markerfacecolor='#264de4', markeredgecolor='black',
            markersize=14, label="Unheated sample"),
@@ -91,6 +86,7 @@ legend_elements = [
 ]
 axes[1].legend(handles=legend_elements, loc="upper right", fontsize=18, title="", frameon=True)
 
+mark("layout")
 plt.tight_layout()
 plt.subplots_adjust(wspace=0.15)
 plt.show()
@@ -1,24 +1,13 @@
 import os
 import numpy as np
 import matplotlib.pyplot as plt
+from profiling import mark
+from raman import preprocess
+from spectra import SpectrumPyramid, SpectrumSet
 
 # paht
 data_folder = r"./Suppl data/Spectra/µ-RS spectra"
 
-# function to read txt file
-def read_raman_file(file_path):
-    data = []
-    with open(file_path, "r") as f:
-        for line in f:
-            parts = line.strip().split()
-            if len(parts) == 2:
-                try:
-                    wavenumber, intensity = float(parts[0]), float(parts[1])
-                    data.append((wavenumber, intensity))
-                except ValueError:
-                    continue
-    return np.array(data)
-
 # palettes
 unheated_colors = {
     "Serpentine": "#009E73",
@@ -32,46 +21,70 @@ heated_colors = {
 }
 
 # common parameters for graphs
+group_spacing = 2
+internal_spacing = 0.2
+reference_names = ["olivine", "lizardite", "magnetite", "diopside", "hematite"]
+# "raw" (as in the paper) or "clean": spike removal, smoothing and baseline subtraction of the sample spectra
+preprocess_mode = os.environ.get("FIG11_PREPROCESS", "raw")
+
+
+# all spectra of a panel in one SpectrumSet, normalised and offset in one batch
+def load_groups(groups, offset_adjustment=0):
+    paths, group_names, is_reference, offsets = [], [], [], []
+    for n_group, (group_name, filenames) in enumerate(groups.items()):
+        group_offset = n_group * group_spacing
+        normal_spectra = [f for f in filenames if f not in reference_names]
+        reference_spectrum = next((f for f in filenames if f in reference_names), None)
+
+        # reference spectrum from subfolder, drawn first
+        candidates = []
+        if reference_spectrum:
+            candidates.append((os.path.join(data_folder, "Reference spectra", reference_spectrum + ".txt"), True,
+                               group_offset - internal_spacing + offset_adjustment))
+        for i, filename in enumerate(normal_spectra):
+            candidates.append((os.path.join(data_folder, filename + ".txt"), False,
+                               group_offset + (i * internal_spacing) + offset_adjustment))
+
+        for path, reference, offset in candidates:
+            if os.path.exists(path):
+                paths.append(path)
+                group_names.append(group_name)
+                is_reference.append(reference)
+                offsets.append(offset)
+
+    spectra = SpectrumSet.from_files(paths, group=group_names, reference=is_reference, offset=offsets)
+    spectra = spectra.select(spectra.lengths > 0)
+    if preprocess_mode == "clean":
+        samples = ~spectra.meta["reference"].to_numpy(dtype=bool)
+        cleaned = preprocess(spectra.select(samples))
+        y = spectra.y.copy()
+        y[np.repeat(samples, spectra.lengths)] = cleaned.y
+        spectra = SpectrumSet(spectra.x, y, spectra.offsets, spectra.meta)
+    return spectra.normalize().offset(spectra.meta["offset"])
+
+
 def plot_group(ax, groups, colors, legend_order, prefix_to_remove, offset_adjustment=0, label_indices=None):
-    group_offset = 0
-    group_spacing = 2
-    internal_spacing = 0.2
     label_counter = 0
     label_total = len(label_indices) if label_indices else 0
+    # drawn at the resolution of the saved figure (dense acquisitions are downsampled)
+    spectra = SpectrumPyramid(load_groups(groups, offset_adjustment)).for_axes(ax)
 
-    for group_name, filenames in groups.items():
+    for group_name in groups:
         color = colors[group_name]
-
-        normal_spectra = [f for f in filenames if f not in ["olivine", "lizardite", "magnetite", "diopside", "hematite"]]
-        reference_spectrum = next((f for f in filenames if f in ["olivine", "lizardite", "magnetite", "diopside", "hematite"]), None)
-
-        # Plot reference spectrum from subfolder
-        if reference_spectrum:
-            ref_path = os.path.join(data_folder, "Reference spectra", reference_spectrum + ".txt")
-            if os.path.exists(ref_path):
-                data = read_raman_file(ref_path)
-                if data.size > 0:
-                    data[:, 1] /= np.max(data[:, 1])
-                    data[:, 1] += group_offset - internal_spacing + offset_adjustment
-                    ax.plot(data[:, 0], data[:, 1], linestyle="--", color=color)
-
-        # Plot normal sample spectra
-        for i, filename in enumerate(normal_spectra):
-            file_path = os.path.join(data_folder, filename + ".txt")
-            if os.path.exists(file_path):
-                data = read_raman_file(file_path)
-                if data.size > 0:
-                    data[:, 1] /= np.max(data[:, 1])
-                    offset = group_offset + (i * internal_spacing) + offset_adjustment
-                    data[:, 1] += offset
-                    ax.plot(data[:, 0], data[:, 1], linestyle="-", color=color)
-                    index = label_indices[label_counter] if label_indices else label_counter + 1
-                    label = f"{label_total - index + 1:02}"
-                    ax.text(data[-1, 0] + 10, offset + 0.05, label, fontsize=10, color=color)
-                    label_counter += 1
+        for i in np.flatnonzero(spectra.meta["group"] == group_name):
+            x, y = spectra[i]
+            if spectra.meta["reference"].iloc[i]:
+                ax.plot(x, y, linestyle="--", color=color)
+                continue
+            # sample spectra, labelled at their right end
+            ax.plot(x, y, linestyle="-", color=color)
+            offset = spectra.meta["offset"].iloc[i]
+            index = label_indices[label_counter] if label_indices else label_counter + 1
+            label = f"{label_total - index + 1:02}"
+            ax.text(x[-1] + 10, offset + 0.05, label, fontsize=10, color=color)
+            label_counter += 1
 
         ax.plot([], [], linestyle="-", color=color, label=group_name)
-        group_offset += group_spacing
 
     ax.plot([], [], linestyle="--", color="gray", label="Reference spectrum")
 
@@ -102,7 +115,8 @@ heated_groups = {
 unheated_order = ["Magnetite", "Olivine", "Serpentine", "Reference spectrum"]
 heated_order = ["Hematite", "Primary olivine", "Secondary olivine", "Reference spectrum"]
 
-# plotting
+# plotting (the spectra are loaded by plot_group)
+mark("render")
 fig, axes = plt.subplots(1, 2, figsize=(18, 8), sharey=True)
 
 plot_group(axes[0], unheated_groups, unheated_colors, unheated_order, prefix_to_remove="MS43B_", label_indices=[1, 2, 3, 4, 5, 6])
@@ -112,5 +126,6 @@ plot_group(axes[1], heated_groups, heated_colors, heated_order, prefix_to_remove
 axes[1].set_title("Heated sample", fontsize=18)
 
 # Final layout adjustment and display
+mark("layout")
 plt.tight_layout()
 plt.show()
@@ -3,6 +3,11 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.lines as mlines
 from pathlib import Path
+import spectra
+from cache import cached_result
+from profiling import mark
+from spectra import SpectrumPyramid, SpectrumSet
+from xrd import phase_peaks
 
 
 # path data XRD
@@ -10,12 +15,13 @@ data_folder = "./Suppl data/Spectra/XRD spectra"
 
 # XRD peaks for minerals
 peaks = {
-    "Olivine": ([17.2, 22.8, 35.5, 52.2], "#56B4E9"),  # yellow
-    "Serpentine": ([12.1, 19.4, 24.6], "#009E73"),  # Vert
-    "Magnetite": ([37.3], "#FFC400"),  # Bleu clair
-    "Hematite": ([33.2], "#D55E00")
+    "Olivine": (phase_peaks["Olivine"], "#56B4E9"),  # yellow
+    "Serpentine": (phase_peaks["Serpentine"], "#009E73"),  # Vert
+    "Magnetite": (phase_peaks["Magnetite"], "#FFC400"),  # Bleu clair
+    "Hematite": (phase_peaks["Hematite"], "#D55E00")
 }
 
+mark("load")
 files_no_red = []
 files_red = []
 
@@ -27,44 +33,35 @@ for filename in os.listdir(data_folder):
         else:
             files_no_red.append(full_path)
 
-# function to read XRD spectra
-def read_xrd_file(file_path):
-    data = []
-    with open(file_path, "r") as f:
-        lines = f.readlines()
-        for line in lines:
-            try:
-                parts = line.strip().split()
-                if len(parts) == 2:
-                    theta, intensity = float(parts[0]), float(parts[1])
-                    data.append((theta, intensity))
-            except ValueError:
-                continue
-    return np.array(data)
+# Normaliser l'intensité (max = 1000) et ajouter un décalage de 1000 par spectre, cached with the spectra as key
+# (with its downsampling pyramid, dense scans are drawn at the resolution of the figure)
+def normalize_spectra(files):
+    normalized = SpectrumSet.from_files(files).normalize(1000)
+    return SpectrumPyramid(normalized.offset(np.arange(len(normalized)) * 1000))
 
 
+pyramid_no_red = cached_result("fig12_no_red", files_no_red + [__file__, spectra.__file__],
+                               lambda: normalize_spectra(files_no_red))
+pyramid_red = cached_result("fig12_red", files_red + [__file__, spectra.__file__],
+                            lambda: normalize_spectra(files_red))
+
+mark("render")
 fig, axes = plt.subplots(2, 1, figsize=(14, 10), sharex=True)
 
 colors = ['#0072B2', '#009E73', '#CC79A7', '#F0E442', '#56B4E9', '#D55E00']
 
 # top graph (unheated)
-for i, file in enumerate(files_no_red):
-    data = read_xrd_file(file)
-    if data.size > 0:
-        # Normaliser l'intensité et ajouter un décalage
-        normalized_intensity = data[:, 1] / np.max(data[:, 1]) * 1000
-        axes[0].plot(data[:, 0], normalized_intensity + i * 1000, label=None, color=colors[i % len(colors)])
+for i, (theta, intensity) in enumerate(pyramid_no_red.for_axes(axes[0])):
+    if len(theta):
+        axes[0].plot(theta, intensity, label=None, color=colors[i % len(colors)])
 
 axes[0].set_title("Unheated samples",fontsize=20)
 axes[0].set_ylabel("Lin (counts)",fontsize=18)
 
 # bottom graph (heated)
-for i, file in enumerate(files_red):
-    data = read_xrd_file(file)
-    if data.size > 0:
-        # Normaliser l'intensité et ajouter un décalage
-        normalized_intensity = data[:, 1] / np.max(data[:, 1]) * 1000
-        axes[1].plot(data[:, 0], normalized_intensity + i * 1000, label=None, color=colors[i % len(colors)])
+for i, (theta, intensity) in enumerate(pyramid_red.for_axes(axes[1])):
+    if len(theta):
+        axes[1].plot(theta, intensity, label=None, color=colors[i % len(colors)])
 
 
 ## display options ##
@@ -127,5 +124,6 @@ axes[1].text(-0.02, 1.06, 'b.', transform=axes[1].transAxes,
              fontsize=16, fontweight='bold', va='top', ha='left')
 
 # Final layout adjustment and display
+mark("layout")
 plt.tight_layout()
 plt.show()
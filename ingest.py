@@ -0,0 +1,324 @@
+import argparse
+import asyncio
+import glob
+import io
+import json
+import os
+import pickle
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+from cache import atomic_write, cache_folder
+from oxides import conv_elem_to_oxides, list_oxides, load_pxrf_oxides
+from tables import file_conv_oxides, file_pms, read_table
+
+# store of the field readings: one append-only log per instrument plus a snapshot of the per-sample aggregates
+# SERP_STORE also makes fig06/07/08 take their per-sample medians from the store
+store_folder = os.environ.get("SERP_STORE", os.path.join(cache_folder, "store"))
+use_store = "SERP_STORE" in os.environ
+
+# grouping keys and aggregated columns of each instrument (pXRF readings are stored as uncalibrated oxides)
+instruments = {
+    "pxrf": {"keys": ["Type", "Facies", "Sample ID"],
+             "values": ["Ni", "Al2O3", "CaO", "Fe2O3T", "K2O", "MgO", "MnO", "SiO2", "TiO2", "MgO/SiO2"]},
+    "pms": {"keys": ["vase_type", "Sample ID"], "values": ["SI"]},
+}
+
+
+# running count/min/max and quantiles of one variable. Values are kept exactly up to 2 * capacity;
+# beyond that, neighbouring centroids are merged pairwise (weighted means), so memory stays bounded
+# and the quantiles become approximate.
+class QuantileSketch:
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0
+        self.min = np.nan
+        self.max = np.nan
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.min = np.fmin(self.min, values.min())
+        self.max = np.fmax(self.max, values.max())
+        means = np.concatenate([self.means, values])
+        weights = np.concatenate([self.weights, np.ones(len(values))])
+        order = np.argsort(means, kind="stable")
+        self.means, self.weights = means[order], weights[order]
+        while len(self.means) > 2 * self.capacity:
+            self._compress()
+
+    def _compress(self):
+        n = len(self.means) // 2 * 2
+        weights = self.weights[:n].reshape(-1, 2)
+        means = (self.means[:n].reshape(-1, 2) * weights).sum(axis=1) / weights.sum(axis=1)
+        self.means = np.concatenate([means, self.means[n:]])
+        self.weights = np.concatenate([weights.sum(axis=1), self.weights[n:]])
+
+    # plain tuple for the snapshot (readable whatever module defines the class, __main__ included)
+    def state(self):
+        return self.capacity, self.means, self.weights, self.count, self.min, self.max
+
+    @classmethod
+    def from_state(cls, state):
+        sketch = cls(state[0])
+        sketch.means, sketch.weights, sketch.count, sketch.min, sketch.max = state[1:]
+        return sketch
+
+    def quantile(self, q):
+        if not self.count:
+            return np.full(np.shape(q), np.nan)
+        if np.all(self.weights == 1):
+            return np.quantile(self.means, q)
+        # centroid i stands for the rank at the middle of its weight
+        ranks = (np.cumsum(self.weights) - self.weights / 2) / self.count
+        values = np.interp(q, ranks, self.means)
+        return np.clip(values, self.min, self.max)
+
+
+def _group_key(values):
+    return tuple(None if isinstance(v, float) and np.isnan(v) else v for v in values)
+
+
+# pXRF readings as exported by the instrument (element ppm) -> stored columns (oxides, MgO/SiO2)
+def prepare_pxrf(df):
+    if "SiO2" not in df.columns:
+        conv_oxides = read_table(file_conv_oxides, columns=['Element', 'Oxide', 'Factor'])
+        # elements missing from a reading (not reported by the instrument) become NaN
+        df = df.reindex(columns=list(df.columns) + [e for e in list_oxides if e not in df.columns])
+        df = conv_elem_to_oxides(df, conv_oxides)
+        df['MgO/SiO2'] = df['MgO'] / df['SiO2']
+    return df
+
+
+# the logs are the deltas: every batch is appended to them and folded into the in-memory aggregates.
+# The snapshot is only a checkpoint, rewritten once `snapshot_every` readings have been logged since
+# the last one (and by flush()); readings logged after it are replayed when the store is opened.
+class ReadingStore:
+    def __init__(self, folder=store_folder, snapshot_every=10000):
+        self.folder = folder
+        self.snapshot_every = snapshot_every
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        os.makedirs(folder, exist_ok=True)
+        self.aggregates = {instrument: {} for instrument in instruments}
+        self.offsets = {instrument: 0 for instrument in instruments}
+        try:
+            with open(self._snapshot_path(), "rb") as f:
+                snapshot = pickle.load(f)
+            self.offsets = snapshot["offsets"]
+            self.aggregates = {instrument: {key: {column: QuantileSketch.from_state(state)
+                                                  for column, state in sketches.items()}
+                                            for key, sketches in groups.items()}
+                               for instrument, groups in snapshot["aggregates"].items()}
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+        # readings logged after the last snapshot (interrupted ingestion)
+        for instrument in instruments:
+            tail = self._read_log(instrument, self.offsets[instrument])
+            if len(tail):
+                self._update(instrument, tail)
+                self.offsets[instrument] = os.path.getsize(self._log_path(instrument))
+
+    def _log_path(self, instrument):
+        return os.path.join(self.folder, f"readings-{instrument}.jsonl")
+
+    def _snapshot_path(self):
+        return os.path.join(self.folder, "aggregates.pkl")
+
+    def _read_log(self, instrument, offset=0):
+        path = self._log_path(instrument)
+        if not os.path.exists(path) or os.path.getsize(path) <= offset:
+            return pd.DataFrame(columns=instruments[instrument]["keys"] + instruments[instrument]["values"])
+        with open(path, "r", encoding="utf-8") as f:
+            f.seek(offset)
+            return pd.read_json(io.StringIO(f.read()), lines=True, dtype=False)
+
+    def _update(self, instrument, df):
+        spec = instruments[instrument]
+        groups = self.aggregates[instrument]
+        values = df[spec["values"]].apply(pd.to_numeric, errors="coerce")
+        for key, rows in df.groupby(spec["keys"], dropna=False, sort=False).indices.items():
+            sketches = groups.setdefault(_group_key(key), {column: QuantileSketch() for column in spec["values"]})
+            block = values.iloc[rows].to_numpy(dtype=float)
+            for j, column in enumerate(spec["values"]):
+                sketches[column].add(block[:, j])
+
+    def _save_snapshot(self):
+        def write(tmp_path):
+            with open(tmp_path, "wb") as f:
+                aggregates = {instrument: {key: {column: sketch.state() for column, sketch in sketches.items()}
+                                           for key, sketches in groups.items()}
+                              for instrument, groups in self.aggregates.items()}
+                pickle.dump({"aggregates": aggregates, "offsets": self.offsets}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        atomic_write(self._snapshot_path(), write)
+
+    # append readings (DataFrame or list of dicts) and update the aggregates of their samples
+    def add(self, instrument, readings):
+        spec = instruments[instrument]
+        df = pd.DataFrame(readings)
+        if instrument == "pxrf":
+            df = prepare_pxrf(df)
+        missing = [column for column in spec["keys"] if column not in df.columns]
+        if missing:
+            raise KeyError(f"{instrument} readings without {missing}")
+        df = df.reindex(columns=spec["keys"] + spec["values"])
+        if not len(df):
+            return 0
+        with self._lock:
+            with open(self._log_path(instrument), "a", encoding="utf-8") as f:
+                f.write(df.to_json(orient="records", lines=True).rstrip("\n") + "\n")
+            self._update(instrument, df)
+            self.offsets[instrument] = os.path.getsize(self._log_path(instrument))
+            self.pending += len(df)
+            if self.pending >= self.snapshot_every:
+                self._flush()
+        return len(df)
+
+    # add() off the event loop, one batch at a time (listeners)
+    async def add_async(self, instrument, readings):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.add, instrument, readings)
+
+    def _flush(self):
+        if self.pending:
+            self._save_snapshot()
+            self.pending = 0
+
+    # checkpoint the aggregates now (before exiting)
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def readings(self, instrument):
+        return self._read_log(instrument)
+
+    # one row per sample: keys + the statistic ("count", "min", "max", "median" or a quantile) of every column
+    def statistic(self, instrument, stat="median"):
+        spec = instruments[instrument]
+        rows = []
+        for key, sketches in self.aggregates[instrument].items():
+            if stat in ("count", "min", "max"):
+                values = [getattr(sketch, stat) for sketch in sketches.values()]
+            else:
+                q = 0.5 if stat == "median" else float(stat)
+                values = [float(sketch.quantile(q)) for sketch in sketches.values()]
+            rows.append([np.nan if v is None else v for v in key] + values)
+        df = pd.DataFrame(rows, columns=spec["keys"] + spec["values"])
+        return df.sort_values(spec["keys"][::-1], ignore_index=True)
+
+    def medians(self, instrument):
+        return self.statistic(instrument, "median")
+
+
+# per-vase median SI in the layout of stats.pms_medians
+def store_pms_medians(vase_types=("Blue vases", "Red vases"), store=None):
+    df = (store or ReadingStore()).medians("pms")
+    df = df[df["vase_type"].isin(vase_types)]
+    return df.sort_values(["vase_type", "Sample ID"], ignore_index=True)
+
+
+# load the supplementary workbooks into an empty store
+def seed_store(store):
+    store.add("pxrf", load_pxrf_oxides())
+    store.add("pms", read_table(file_pms, columns=["Sample ID", "vase_type", "SI"]))
+
+
+# newline-delimited JSON over TCP: {"instrument": "pms", "Sample ID": ..., "vase_type": ..., "SI": ...}
+# (or a list of such readings); answers "ok <n>" or "error <message>" per line
+async def serve(store, host="127.0.0.1", port=8765):
+    async def handle(reader, writer):
+        while line := await reader.readline():
+            try:
+                message = json.loads(line)
+                readings = message if isinstance(message, list) else [message]
+                by_instrument = {}
+                for reading in readings:
+                    by_instrument.setdefault(reading.pop("instrument"), []).append(reading)
+                n = 0
+                for instrument, batch in by_instrument.items():
+                    n += await store.add_async(instrument, batch)
+                writer.write(f"ok {n}\n".encode())
+            except (ValueError, KeyError, AttributeError) as error:
+                writer.write(f"error {error}\n".encode())
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+# ingest the tables dropped in a folder (pxrf_*.csv, pms_*.xlsx, ...), then move them to processed/;
+# tables that cannot be read or ingested (missing key columns...) go to rejected/ and the others carry on
+async def watch_folder(store, folder, interval=2.0):
+    processed = os.path.join(folder, "processed")
+    rejected = os.path.join(folder, "rejected")
+    os.makedirs(processed, exist_ok=True)
+    os.makedirs(rejected, exist_ok=True)
+    print(f"watching {folder}")
+    while True:
+        for path in sorted(glob.glob(os.path.join(folder, "*.*"))):
+            name = os.path.basename(path)
+            instrument = name.split("_")[0].lower()
+            if instrument not in instruments:
+                continue
+            reader = pd.read_excel if path.lower().endswith((".xlsx", ".xls")) else pd.read_csv
+            try:
+                n = await store.add_async(instrument, await asyncio.to_thread(reader, path))
+            except Exception as error:
+                shutil.move(path, os.path.join(rejected, name))
+                print(f"{name}: rejected, {type(error).__name__}: {error}", file=sys.stderr)
+                continue
+            shutil.move(path, os.path.join(processed, name))
+            print(f"{name}: {n} {instrument} reading(s)")
+        await asyncio.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest pXRF/pMS field readings and keep per-sample aggregates.")
+    parser.add_argument("--store", default=store_folder, help="store folder")
+    parser.add_argument("--seed", action="store_true", help="load the supplementary workbooks into an empty store")
+    parser.add_argument("--serve", nargs="?", type=int, const=8765, metavar="PORT", help="listen on a local socket")
+    parser.add_argument("--drop", metavar="FOLDER", help="ingest the tables dropped in a folder")
+    parser.add_argument("--summary", choices=list(instruments), help="print the per-sample medians")
+    args = parser.parse_args(argv)
+
+    store = ReadingStore(args.store)
+    if args.seed:
+        if any(store.aggregates.values()):
+            parser.error(f"{args.store} is not empty")
+        seed_store(store)
+        store.flush()
+    if args.summary:
+        print(store.medians(args.summary).to_string())
+
+    tasks = []
+    if args.serve:
+        tasks.append(serve(store, port=args.serve))
+    if args.drop:
+        tasks.append(watch_folder(store, args.drop))
+    if tasks:
+        async def run():
+            await asyncio.gather(*tasks)
+        try:
+            asyncio.run(run())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            store.flush()
+
+
+if __name__ == "__main__":
+    main()
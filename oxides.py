@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+from profiling import profiled
+from tables import (apply_schema, concat_tables, file_conv_oxides, file_deschamps, file_pxrf, read_table,
+                    read_table_chunks)
+
+# elements measured by pXRF that are reported as oxides
+list_oxides = ['Al', 'Ca', 'Fe', 'K', 'Mg', 'Mn', 'Si', 'Ti']
+# label columns of the geochemical tables (categoricals in the typed schema); Facies stays a numeric
+# code, the figures key their palettes on its values
+label_columns = ['Sample ID', 'Type']
+# measured columns that may be requested next to the labels (float32 in the typed schema)
+measured_columns = ['Ni', 'Cr', 'Co', 'Zn', 'Cu']
+# major oxides entering the sum of oxides
+major_oxides = ['MgO', 'Al2O3', 'SiO2', 'K2O', 'CaO', 'MnO', 'Fe2O3T']
+# oxides of the worldwide compilation (Deschamps 2013), normalized to its analytical totals
+compilation_oxides = ['SiO2', 'TiO2', 'Al2O3', 'Cr2O3', 'Fe2O3T', 'MnO', 'NiO', 'MgO', 'CaO', 'Na2O', 'K2O', 'P2O5']
+# oxides of the compilation scaled to the analytical total in the published fig06 (the numeric columns
+# of the workbook); the others, stored as text ("n.d."...), are only converted to numbers
+compilation_normalized = ['SiO2', 'Fe2O3T', 'MnO', 'MgO', 'CaO']
+
+
+# oxide names and element/oxide mass factors, in the order of `elements`
+def oxide_factors(conv_oxides, elements):
+    table = conv_oxides.dropna(subset=['Element']).drop_duplicates('Element').set_index('Element')
+    missing = [element for element in elements if element not in table.index]
+    if missing:
+        raise KeyError(f"no oxide conversion factor for {missing}")
+    table = table.loc[elements]
+    return list(table['Oxide']), table['Factor'].to_numpy(dtype=float)
+
+
+# columns as one float matrix, text entries ("n.d.", "<0.2"...) becoming NaN
+# dtype=None: float32 if all the columns are float32 (typed tables), float64 otherwise
+def numeric_block(df, columns, dtype=float):
+    block = df[columns]
+    if all(pd.api.types.is_numeric_dtype(column_dtype) for column_dtype in block.dtypes):
+        return block.to_numpy(dtype=dtype or np.result_type(np.float32, *block.dtypes))
+    return block.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=dtype or float)
+
+
+# ppm of elements -> wt.% of oxides, as one block operation; element columns are dropped
+def elements_to_oxides(df, conv_oxides, elements=list_oxides):
+    elements = [element for element in elements if element in df.columns]
+    oxides, factors = oxide_factors(conv_oxides, elements)
+    values = numeric_block(df, elements) / (factors * 10000)
+    df_oxides = pd.DataFrame(values, columns=oxides, index=df.index)
+    return pd.concat([df.drop(columns=elements + [o for o in oxides if o in df.columns]), df_oxides], axis=1)
+
+
+# rescale `columns` to 100 % of `total` (one value per row) in a single block operation
+# total=None -> anhydrous normalization to the sum of the columns themselves
+def normalize_to_100(df, columns, total=None):
+    values = numeric_block(df, columns)
+    if total is None:
+        total = np.nansum(values, axis=1)
+    total = np.asarray(pd.to_numeric(total, errors='coerce'), dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = values * (100 / total)[:, None]
+    df[columns] = values
+    return df
+
+
+# wet-chemistry analyses: oxides reported with their analytical total (incl. L.O.I.)
+@profiled()
+def normalize_wet_chemistry(df, columns, total_column='Total'):
+    return normalize_to_100(df, columns, df[total_column])
+
+
+def normalize_anhydrous(df, columns=major_oxides):
+    return normalize_to_100(df, columns)
+
+
+# pXRF table -> oxides, Mg#, sum of oxides and MgO/SiO2
+@profiled()
+def conv_elem_to_oxides(df, conv_oxides, elements=list_oxides):
+    if 'Mg' in df.columns and 'Fe' in df.columns:
+        mg = pd.to_numeric(df['Mg'], errors='coerce')
+        mg_number = mg / (mg + pd.to_numeric(df['Fe'], errors='coerce'))
+    else:
+        mg_number = None
+
+    df = elements_to_oxides(df, conv_oxides, elements)
+    extra = {}
+    if mg_number is not None:
+        extra['Mg#'] = mg_number
+    extra['Sum_of_oxydes_before_normalization'] = np.nansum(numeric_block(df, major_oxides), axis=1)
+    extra['MgOSiO2'] = df['MgO'] / df['SiO2']
+    return pd.concat([df, pd.DataFrame(extra, index=df.index)], axis=1)
+
+
+# pXRF workbook -> oxides and MgO/SiO2 (before calibration)
+# typed: label columns as categoricals and measurements as float32 (computed in float64 first)
+def load_pxrf_oxides(columns=('Type', 'Facies', 'Sample ID', 'Ni'), typed=False):
+    conv_oxides = read_table(file_conv_oxides, columns=['Element', 'Oxide', 'Factor'])
+    df = read_table(file_pxrf, columns=list(columns) + list_oxides)
+    df = conv_elem_to_oxides(df, conv_oxides)
+    df['MgO/SiO2'] = df['MgO'] / df['SiO2']
+    if typed:
+        df = apply_schema(df, label_columns, [c for c in df.columns if c not in label_columns and c not in columns]
+                          + [c for c in columns if c in measured_columns])
+    return df
+
+
+# compilation table -> normalized oxides (as published), numeric Ni and MgO/SiO2
+def normalize_compilation(df):
+    df = normalize_wet_chemistry(df, compilation_normalized)
+    others = [c for c in compilation_oxides if c not in compilation_normalized]
+    df[others] = numeric_block(df, others)
+    df['MgO/SiO2'] = df['MgO'] / df["SiO2"]
+    df['Ni'] = pd.to_numeric(df['Ni'], errors='coerce')
+    return df
+
+
+def _world_serp_block(df, typed):
+    df = normalize_compilation(df)
+    if typed:
+        df = apply_schema(df, label_columns, compilation_oxides + ['Total', 'Ni', 'MgO/SiO2'])
+    return df
+
+
+# worldwide serpentinite compilation, normalized, with MgO/SiO2
+# extra_columns: descriptive columns to keep (Facies, Location...)
+# chunk_rows: normalize and type the compilation block by block, so that only one block is
+# held in float64 / object form at a time (multi-million-row compilations)
+def load_world_serp(extra_columns=(), typed=False, chunk_rows=None):
+    columns = list(extra_columns) + compilation_oxides + ['Total', 'Ni']
+    if chunk_rows is None:
+        return _world_serp_block(read_table(file_deschamps, columns=columns), typed)
+    return concat_tables(_world_serp_block(chunk, typed)
+                         for chunk in read_table_chunks(file_deschamps, columns, chunk_rows))
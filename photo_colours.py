@@ -0,0 +1,208 @@
+import argparse
+import contextlib
+import glob
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from colours import rgb_to_hsv, rgb_to_lab
+
+try:
+    import tifffile
+except ImportError:  # only needed for memory-mapped TIFF reads
+    tifffile = None
+
+image_extensions = (".tif", ".tiff", ".png", ".jpg", ".jpeg", ".bmp")
+# rows converted at once: memory stays ~ band_rows x image width whatever the region size
+band_rows = 256
+# PIL decodes a whole image on its first read (JPEG, PNG, compressed TIFF): JPEGs above this size are
+# decoded at 1/2, 1/4 or 1/8 scale (DCT scaling in the decoder), the other formats at full size
+max_decoded_pixels = 100_000_000
+
+# histogram bins of every channel; medians and quantiles are read from the cumulated histograms
+channel_bins = {
+    "R": np.linspace(0, 1, 257), "G": np.linspace(0, 1, 257), "B": np.linspace(0, 1, 257),
+    "Hue": np.linspace(0, 360, 721), "Saturation": np.linspace(0, 1, 513), "Value": np.linspace(0, 1, 513),
+    "L*": np.linspace(0, 100, 401), "a*": np.linspace(-128, 128, 513), "b*": np.linspace(-128, 128, 513),
+}
+
+
+# lift PIL's decompression-bomb limit while opening trusted photographs only
+@contextlib.contextmanager
+def _large_images():
+    limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        yield
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+
+# memory-mapped array for uncompressed TIFF (and .npy) files, PIL image otherwise
+def open_image(path):
+    if path.lower().endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    if tifffile is not None and path.lower().endswith((".tif", ".tiff")):
+        try:
+            return tifffile.memmap(path, mode="r")
+        except ValueError:  # compressed or tiled: decode through PIL
+            pass
+    with _large_images():
+        return Image.open(path)
+
+
+# decode JPEGs larger than max_pixels at a reduced scale; returns the scale of the decoded pixels
+def _reduce(image, max_pixels=max_decoded_pixels):
+    if not isinstance(image, Image.Image) or image.format != "JPEG" or not max_pixels:
+        return 1.0
+    width, height = image.size
+    if width * height <= max_pixels:
+        return 1.0
+    shrink = math.sqrt(width * height / max_pixels)
+    # the decoder picks the smallest of its scales that is at least the requested size
+    image.draft("RGB", (math.ceil(width / shrink), math.ceil(height / shrink)))
+    return image.size[0] / width
+
+
+def _image_size(image):
+    return image.size if isinstance(image, Image.Image) else (image.shape[1], image.shape[0])
+
+
+# RGB pixels of a window as an (n, 3) float array in [0, 1]
+def _read_window(image, x0, y0, x1, y1):
+    if isinstance(image, Image.Image):
+        window = np.asarray(image.crop((x0, y0, x1, y1)).convert("RGB"))
+    else:
+        window = np.asarray(image[y0:y1, x0:x1])
+        if window.ndim == 2:
+            window = np.repeat(window[..., None], 3, axis=2)
+        window = window[..., :3]
+    scale = 255.0 if window.dtype == np.uint8 else float(np.iinfo(window.dtype).max) \
+        if np.issubdtype(window.dtype, np.integer) else 1.0
+    return window.reshape(-1, 3) / scale
+
+
+# median and quantiles from a histogram
+def _hist_quantiles(counts, edges, quantiles):
+    cumulated = np.cumsum(counts)
+    if cumulated[-1] == 0:
+        return [np.nan] * len(quantiles)
+    centres = (edges[:-1] + edges[1:]) / 2
+    return [centres[np.searchsorted(cumulated, q * cumulated[-1])] for q in quantiles]
+
+
+# hue is circular: turn the histogram so that the mean direction sits at 180° before taking quantiles
+def _hue_quantiles(counts, edges, quantiles):
+    centres = (edges[:-1] + edges[1:]) / 2
+    angle = np.radians(centres)
+    mean = np.degrees(np.arctan2((counts * np.sin(angle)).sum(), (counts * np.cos(angle)).sum())) % 360
+    shift = int(round((180 - mean) / (edges[1] - edges[0])))
+    values = _hist_quantiles(np.roll(counts, shift), edges, quantiles)
+    return [(value - shift * (edges[1] - edges[0])) % 360 for value in values]
+
+
+# colour distribution of one region, read band by band
+def region_statistics(image, box):
+    x0, y0, x1, y1 = box
+    histograms = {name: np.zeros(len(edges) - 1) for name, edges in channel_bins.items()}
+    rgb_sum = np.zeros(3)
+    n_pixels = 0
+    for y in range(y0, y1, band_rows):
+        rgb = _read_window(image, x0, y, x1, min(y + band_rows, y1))
+        hsv = rgb_to_hsv(rgb)
+        lab = rgb_to_lab(rgb)
+        channels = np.column_stack([rgb, hsv[:, 0] * 360, hsv[:, 1:], lab])
+        for i, (name, edges) in enumerate(channel_bins.items()):
+            histograms[name] += np.histogram(channels[:, i], bins=edges)[0]
+        rgb_sum += rgb.sum(axis=0)
+        n_pixels += len(rgb)
+
+    # "Hex" is the mean colour of the region, like the Photoshop eyedropper average used for fig10
+    mean_rgb = np.round(rgb_sum / max(n_pixels, 1) * 255).astype(int)
+    stats = {"Hex": "#{:02x}{:02x}{:02x}".format(*mean_rgb), "Pixels": n_pixels}
+    for name, edges in channel_bins.items():
+        quantile = _hue_quantiles if name == "Hue" else _hist_quantiles
+        q25, median, q75 = quantile(histograms[name], edges, [0.25, 0.5, 0.75])
+        stats[name] = median
+        stats[f"{name} IQR"] = (q75 - q25) % 360 if name == "Hue" else q75 - q25
+    return stats
+
+
+# region field as a pixel coordinate; missing or empty cells (NaN in a region table) give `default`
+def _coordinate(region, key, default):
+    value = region.get(key)
+    return default if value is None or pd.isna(value) else int(value)
+
+
+# all regions of one image (one worker task); region coordinates are in full-size pixels
+def _image_regions(path, regions, max_pixels=max_decoded_pixels):
+    image = open_image(path)
+    width, height = _image_size(image)
+    scale = _reduce(image, max_pixels)
+    decoded_width, decoded_height = _image_size(image)
+    rows = []
+    for region in regions:
+        x, y = _coordinate(region, "x", 0), _coordinate(region, "y", 0)
+        w = _coordinate(region, "width", width - x)
+        h = _coordinate(region, "height", height - y)
+        box = (max(round(x * scale), 0), max(round(y * scale), 0),
+               min(round((x + w) * scale), decoded_width), min(round((y + h) * scale), decoded_height))
+        sample_type = region.get("Type", "")
+        rows.append({"Sample ID": region["Sample ID"], "Type": "" if pd.isna(sample_type) else sample_type,
+                     "Image": os.path.basename(path), "Scale": scale, **region_statistics(image, box)})
+    return rows
+
+
+# regions to measure: a CSV/XLSX with columns Image, Sample ID, Type, x, y, width, height,
+# or, without one, every image of the folder as a whole (Sample ID = file name)
+def read_regions(image_folder, regions_file=None, sample_type=""):
+    if regions_file:
+        reader = pd.read_excel if regions_file.lower().endswith((".xlsx", ".xls")) else pd.read_csv
+        regions = reader(regions_file)
+        regions["Image"] = [os.path.join(image_folder, name) for name in regions["Image"]]
+        return regions.to_dict("records")
+    images = sorted(path for path in glob.glob(os.path.join(image_folder, "*"))
+                    if path.lower().endswith(image_extensions + (".npy",)))
+    return [{"Image": path, "Sample ID": os.path.splitext(os.path.basename(path))[0], "Type": sample_type}
+            for path in images]
+
+
+# colour table for every region, images processed in parallel (one image per task)
+def extract_colours(regions, jobs=None, max_pixels=max_decoded_pixels):
+    by_image = {}
+    for region in regions:
+        by_image.setdefault(region["Image"], []).append(region)
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        results = pool.map(_image_regions, by_image.keys(), by_image.values(), [max_pixels] * len(by_image))
+        rows = [row for image_rows in results for row in image_rows]
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Colour statistics of vase/sample photographs, "
+                                                 "written with the columns of 'suppl data Munsell.xlsx'.")
+    parser.add_argument("images", help="folder of photographs")
+    parser.add_argument("-r", "--regions", help="CSV/XLSX of regions (Image, Sample ID, Type, x, y, width, height)")
+    parser.add_argument("-t", "--type", default="", help="Type given to whole images when no region file is used")
+    parser.add_argument("-o", "--output", default="photo colours.xlsx", help="output table (.xlsx or .csv)")
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    parser.add_argument("--max-pixels", type=int, default=max_decoded_pixels,
+                        help="JPEGs above this size are decoded at reduced scale (0: always full size)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    df = extract_colours(read_regions(args.images, args.regions, args.type), args.jobs, args.max_pixels)
+    if args.output.lower().endswith(".csv"):
+        df.to_csv(args.output, index=False)
+    else:
+        df.to_excel(args.output, index=False)
+    print(f"{len(df)} region(s) in {time.perf_counter() - start:.1f} s -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import atexit
+import functools
+import os
+import sys
+import time
+import tracemalloc
+
+from cache import cache_path, write_json
+
+# SERP_PROFILE=1: stage timers and peak memory (tracemalloc), SERP_PROFILE=time: timers only
+enabled = False
+
+_root = None
+_stack = []
+
+
+class _Stage:
+    def __init__(self, name, marked=False):
+        self.name = name
+        self.marked = marked
+        self.children = []
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        self.peak = 0
+
+    def as_dict(self):
+        entry = {"name": self.name, "seconds": self.seconds, "children": [child.as_dict() for child in self.children]}
+        if tracemalloc.is_tracing():
+            entry["peak_bytes"] = self.peak
+        return entry
+
+
+def _memory_peak():
+    return tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+
+
+def enable(memory=True):
+    global enabled
+    enabled = True
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+# enable profiling if SERP_PROFILE asks for it (also called by processes forked before it was set)
+def enable_from_environment():
+    mode = os.environ.get("SERP_PROFILE", "")
+    if mode not in ("", "0"):
+        enable(memory=mode != "time")
+    return enabled
+
+
+# start a new report (one per figure when the build process is reused)
+def reset(name=None):
+    global _root
+    _root = _Stage(name or os.path.splitext(os.path.basename(sys.argv[0] or "run"))[0])
+    _stack[:] = [_root]
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+
+def _open(name, marked=False):
+    if _root is None:
+        reset()
+    parent = _stack[-1]
+    parent.peak = max(parent.peak, _memory_peak())
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    stage = _Stage(name, marked)
+    parent.children.append(stage)
+    _stack.append(stage)
+    return stage
+
+
+def _close(stage):
+    # stages opened by mark() inside `stage` end with it
+    while _stack[-1] is not stage:
+        _close(_stack[-1])
+    _stack.pop()
+    stage.seconds = time.perf_counter() - stage.start
+    stage.peak = max(stage.peak, _memory_peak())
+    _stack[-1].peak = max(_stack[-1].peak, stage.peak)
+
+
+# time the enclosed block as a named stage (stages opened inside it become its children)
+class stage:
+    def __init__(self, name):
+        self.name = name
+        self._stage = None
+
+    def __enter__(self):
+        if enabled:
+            self._stage = _open(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        if self._stage is not None:
+            _close(self._stage)
+        return False
+
+
+# end the stage opened by the previous mark() at this level and start a new one,
+# to split a script into load / transform / aggregate / render without re-indenting it
+def mark(name):
+    if not enabled:
+        return
+    if _root is None:
+        reset()
+    if _stack[-1].marked:
+        _close(_stack[-1])
+    _open(name, marked=True)
+
+
+# decorator: every call of the function is a stage
+def profiled(name=None):
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with stage(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _folded(entry, prefix, lines):
+    path = f"{prefix};{entry['name']}" if prefix else entry["name"]
+    own = entry["seconds"] - sum(child["seconds"] for child in entry["children"])
+    lines.append(f"{path} {max(int(round(own * 1e6)), 0)}")
+    for child in entry["children"]:
+        _folded(child, path, lines)
+    return lines
+
+
+# close the open stages and return the report: a stage tree (seconds, peak_bytes) and the same
+# tree in folded-stack format ("a;b;c <self microseconds>", read by flamegraph.pl and speedscope)
+def report():
+    if _root is None or not _root.children:
+        return None
+    while len(_stack) > 1:
+        _close(_stack[-1])
+    _root.seconds = time.perf_counter() - _root.start
+    _root.peak = max(_root.peak, _memory_peak())
+    tree = _root.as_dict()
+    return {"stages": tree, "folded": _folded(tree, "", [])}
+
+
+# <folder>/<name>.json and <name>.folded
+def write_report(folder=None, name=None):
+    global _root
+    result = report()
+    if result is None:
+        return None
+    name = name or result["stages"]["name"]
+    path = os.path.join(folder, f"{name}.json") if folder else cache_path("profile", f"{name}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_json(path, result)
+    with open(os.path.splitext(path)[0] + ".folded", "w", encoding="utf-8") as f:
+        f.write("\n".join(result["folded"]) + "\n")
+    _stack.clear()
+    _root = None
+    return path
+
+
+def _write_at_exit():
+    path = write_report()
+    if path:
+        print(f"profile -> {path}", file=sys.stderr)
+
+
+if enable_from_environment():
+    reset()
+    atexit.register(_write_at_exit)
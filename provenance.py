@@ -0,0 +1,88 @@
+import argparse
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+import oxides
+from cache import cached_result
+from calibration import apply_calibration
+from oxides import load_pxrf_oxides, load_world_serp
+from tables import file_conv_oxides, file_deschamps, file_pxrf
+
+# variables compared (those of fig06); trace-like ones spanning orders of magnitude are taken in log10
+default_features = ["MgO/SiO2", "Al2O3", "CaO", "Ni"]
+log_features = ["CaO", "Ni"]
+# descriptive columns of the compilation returned with each neighbour
+reference_columns = ["Sample ID", "Facies", "Context", "Rock type", "Location"]
+
+
+def _feature_matrix(df, features):
+    matrix = df[features].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float, copy=True)
+    for j, feature in enumerate(features):
+        if feature in log_features:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                matrix[:, j] = np.log10(np.where(matrix[:, j] > 0, matrix[:, j], np.nan))
+    return matrix
+
+
+# KD-tree over the standardized features of the compilation rows where all features are known
+def build_index(df_reference, features=default_features):
+    matrix = _feature_matrix(df_reference, features)
+    complete = np.isfinite(matrix).all(axis=1)
+    mean, std = matrix[complete].mean(axis=0), matrix[complete].std(axis=0)
+    std[std == 0] = 1.0
+    return {"features": list(features), "mean": mean, "std": std,
+            "tree": cKDTree((matrix[complete] - mean) / std),
+            "references": df_reference.loc[complete, [c for c in reference_columns if c in df_reference]]
+            .reset_index(drop=True)}
+
+
+# index of the Deschamps compilation, persisted in the cache and rebuilt only when the workbook changes
+def compilation_index(features=default_features):
+    return cached_result("provenance_index-" + "-".join(features), [file_deschamps, __file__, oxides.__file__],
+                         lambda: build_index(load_world_serp(reference_columns), features))
+
+
+# k nearest reference serpentinites of every query row, in one batched tree query
+# returns one row per (query, neighbour) with the standardized distance and the reference's setting
+def nearest_references(df_query, k=5, index=None, id_column="Sample ID"):
+    index = compilation_index() if index is None else index
+    matrix = (_feature_matrix(df_query, index["features"]) - index["mean"]) / index["std"]
+    complete = np.isfinite(matrix).all(axis=1)
+    k = min(k, index["tree"].n)
+    distances, neighbours = index["tree"].query(matrix[complete], k=k)
+    distances, neighbours = distances.reshape(-1, k), neighbours.reshape(-1, k)
+
+    query_ids = (df_query[id_column] if id_column in df_query else df_query.index.to_series()).to_numpy()
+    result = index["references"].iloc[neighbours.ravel()].add_prefix("Reference ").reset_index(drop=True)
+    result.insert(0, "Distance", distances.ravel())
+    result.insert(0, "Rank", np.tile(np.arange(1, k + 1), complete.sum()))
+    result.insert(0, id_column, np.repeat(query_ids[complete], k))
+    return result
+
+
+# median composition of every vase / heated sample, calibrated as in fig06
+def vase_medians(features=default_features):
+    df = cached_result("pxrf_oxides", [file_pxrf, file_conv_oxides, oxides.__file__], load_pxrf_oxides)
+    df = apply_calibration(df)
+    return df.groupby(["Sample ID", "Type"])[list(features)].median().reset_index()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Nearest worldwide serpentinites of every vase median.")
+    parser.add_argument("-k", type=int, default=5, help="neighbours per vase")
+    parser.add_argument("-o", "--output", help="write the table (.csv or .xlsx)")
+    args = parser.parse_args(argv)
+
+    result = nearest_references(vase_medians(), args.k)
+    if args.output and args.output.lower().endswith(".csv"):
+        result.to_csv(args.output, index=False)
+    elif args.output:
+        result.to_excel(args.output, index=False)
+    settings = result.groupby("Sample ID")["Reference Facies"].agg(lambda s: s.value_counts().index[0])
+    with pd.option_context("display.width", 200, "display.max_rows", None):
+        print(settings.rename("Most frequent setting among neighbours"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from cache import cached_result
+from spectra import SpectrumSet, read_spectrum
+
+# scipy is only imported by the preprocessing functions that need it: phase matching alone starts faster
+
+raman_folder = r"./Suppl data/Spectra/µ-RS spectra"
+reference_folder = os.path.join(raman_folder, "Reference spectra")
+# reference spectrum -> phase it stands for
+reference_phases = {
+    "lizardite": "Serpentine",
+    "antigorite": "Serpentine",
+    "olivine": "Olivine",
+    "magnetite": "Magnetite",
+    "hematite": "Hematite",
+}
+# common wavenumber grid (cm-1), the range shown in fig11
+default_grid = np.arange(200.0, 1200.0 + 1e-9, 2.0)
+
+
+# resample spectra ((n, 2) arrays) onto one grid -> (n_spectra, n_grid) matrix, NaN outside each spectrum
+def resample(spectra, grid=default_grid):
+    matrix = np.full((len(spectra), len(grid)), np.nan)
+    for i, data in enumerate(spectra):
+        if len(data):
+            order = np.argsort(data[:, 0], kind="stable")
+            matrix[i] = np.interp(grid, data[order, 0], data[order, 1], left=np.nan, right=np.nan)
+    return matrix
+
+
+# rows scaled to a maximum of 1 (as in fig11), missing points set to 0
+def normalize_rows(matrix):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        matrix = matrix / np.nanmax(matrix, axis=1, keepdims=True)
+    return np.nan_to_num(matrix, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+# rows centred and scaled to unit norm, so that a dot product is a Pearson correlation
+def standardize_rows(matrix):
+    matrix = matrix - np.nanmean(matrix, axis=1, keepdims=True)
+    matrix = np.nan_to_num(matrix, nan=0.0)
+    norm = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norm[norm == 0] = 1.0
+    return matrix / norm
+
+
+# reference library on the common grid: (names, normalized matrix)
+def load_references(folder=reference_folder, grid=default_grid, names=None):
+    names = sorted(reference_phases) if names is None else list(names)
+    files = [os.path.join(folder, name + ".txt") for name in names]
+
+    def compute():
+        return normalize_rows(resample([read_spectrum(file) for file in files], grid))
+
+    # the grid is part of the name, the reference files and this module are the cache key
+    name = f"raman_references-{grid[0]:g}-{grid[-1]:g}-{len(grid)}"
+    return names, cached_result(name, files + [__file__], compute)
+
+
+# Pearson correlation of every spectrum with every reference: (n_spectra, n_references)
+def correlate(matrix, references):
+    return standardize_rows(matrix) @ standardize_rows(references).T
+
+
+# non-negative unmixing of every spectrum as a sum of references plus a flat background,
+# solved for the whole batch at once by projected gradient: (n_spectra, n_references + 1)
+def unmix(matrix, references, n_iter=500):
+    components = np.vstack([references, np.ones(references.shape[1])])
+    gram = components @ components.T
+    rhs = components @ matrix.T
+    step = 1.0 / np.linalg.eigvalsh(gram)[-1]
+    coefficients = np.clip(np.linalg.lstsq(gram, rhs, rcond=None)[0], 0, None)
+    for _ in range(n_iter):
+        coefficients = np.clip(coefficients - step * (gram @ coefficients - rhs), 0, None)
+    return coefficients.T
+
+
+# phase identification of a batch of spectra
+# returns one row per spectrum: correlation with each phase (best reference of the phase),
+# unmixed fraction of each phase, best phase and its correlation
+def identify_phases(spectra, names=None, grid=default_grid, references=None):
+    if references is None:
+        ref_names, references = load_references(grid=grid)
+    else:
+        ref_names, references = references
+    names = list(range(len(spectra))) if names is None else list(names)
+    matrix = normalize_rows(resample(spectra, grid))
+
+    phases = list(dict.fromkeys(reference_phases[name] for name in ref_names))
+    ref_phase = np.array([phases.index(reference_phases[name]) for name in ref_names])
+    correlation = correlate(matrix, references)
+    fractions = unmix(matrix, references)[:, :-1]
+
+    # per phase: best correlation among its references, summed unmixing weights
+    phase_correlation = np.full((len(spectra), len(phases)), -np.inf)
+    phase_fraction = np.zeros((len(spectra), len(phases)))
+    for j in range(len(ref_names)):
+        phase_correlation[:, ref_phase[j]] = np.maximum(phase_correlation[:, ref_phase[j]], correlation[:, j])
+        phase_fraction[:, ref_phase[j]] += fractions[:, j]
+    total = phase_fraction.sum(axis=1, keepdims=True)
+    total[total == 0] = 1.0
+    phase_fraction /= total
+
+    df = pd.DataFrame(phase_correlation, index=pd.Index(names, name="Spectrum"),
+                      columns=[f"r {phase}" for phase in phases])
+    df[[f"fraction {phase}" for phase in phases]] = phase_fraction
+    best = np.argmax(phase_correlation, axis=1)
+    df["Phase"] = np.array(phases)[best]
+    df["r"] = phase_correlation[np.arange(len(spectra)), best]
+    return df
+
+
+# cosmic spikes: points standing above a running median by more than `threshold` robust noise
+# levels and making most of their height above the local floor (a real band is only trimmed at
+# its top by the median, a spike disappears entirely). They are replaced by linear interpolation
+# between the neighbouring good points. matrix: (n_spectra, n_points), all rows at once
+def remove_spikes(matrix, threshold=8.0, window=5, width=1, spike_fraction=0.5):
+    from scipy import ndimage
+
+    matrix = np.asarray(matrix, dtype=float)
+    # mirrored edges: with repeated edge samples a spike on the first or last channel would be its own median
+    median = ndimage.median_filter(matrix, size=(1, window), mode="mirror")
+    residual = matrix - median
+    floor = ndimage.minimum_filter(median, size=(1, 4 * window + 1), mode="nearest")
+    mad = 1.4826 * np.median(np.abs(residual - np.median(residual, axis=1, keepdims=True)), axis=1, keepdims=True)
+    mad[mad == 0] = np.finfo(float).eps
+    spikes = (residual > threshold * mad) & (residual > spike_fraction * (matrix - floor))
+    if width:
+        # widened along each spectrum only (no wrap-around from one end to the other)
+        spikes = ndimage.maximum_filter1d(spikes.view(np.uint8), 2 * width + 1, axis=1, mode="constant") > 0
+    if not spikes.any():
+        return matrix
+
+    # previous and next good point of every point, then linear interpolation between them
+    columns = np.broadcast_to(np.arange(matrix.shape[1]), matrix.shape)
+    previous = np.maximum.accumulate(np.where(~spikes, columns, -1), axis=1)
+    following = np.minimum.accumulate(np.where(~spikes, columns, matrix.shape[1])[:, ::-1], axis=1)[:, ::-1]
+    previous_ok, following_ok = previous >= 0, following < matrix.shape[1]
+    previous = np.where(previous_ok, previous, following)
+    following = np.where(following_ok, following, previous)
+    rows = np.arange(matrix.shape[0])[:, None]
+    previous, following = np.clip(previous, 0, matrix.shape[1] - 1), np.clip(following, 0, matrix.shape[1] - 1)
+    span = np.where(following > previous, following - previous, 1)
+    weight = np.clip((columns - previous) / span, 0, 1)
+    filled = matrix[rows, previous] * (1 - weight) + matrix[rows, following] * weight
+    return np.where(spikes, filled, matrix)
+
+
+# Savitzky-Golay smoothing of all rows at once
+def smooth(matrix, window=7, order=2):
+    from scipy import signal
+
+    if window < order + 2 or matrix.shape[1] < window:
+        return np.asarray(matrix, dtype=float)
+    return signal.savgol_filter(matrix, window, order, axis=1, mode="nearest")
+
+
+# lam * D'D for second differences, in the banded (upper) form used by solveh_banded
+@lru_cache(maxsize=32)
+def _penalty_bands(n_points, lam):
+    from scipy import sparse
+
+    d = sparse.diags([1.0, -2.0, 1.0], [0, 1, 2], shape=(n_points - 2, n_points))
+    penalty = (lam * (d.T @ d)).todia()
+    bands = np.zeros((3, n_points))
+    for offset, values in zip(penalty.offsets, penalty.data):
+        if offset >= 0:
+            bands[2 - offset, offset:] = values[offset:]
+    return bands
+
+
+# asymmetric least-squares baseline (Eilers & Boelens 2005) of every row
+# the pentadiagonal systems (W + lam D'D) z = W y of all rows are solved together as one banded
+# system: rows laid end to end, the penalty bands do not couple one row to the next
+def asls_baseline(matrix, lam=1e5, p=0.01, n_iter=10):
+    from scipy import linalg
+
+    matrix = np.asarray(matrix, dtype=float)
+    n_rows, n_points = matrix.shape
+    if n_points < 3 or n_rows == 0:
+        return np.zeros_like(matrix)
+    bands = np.tile(_penalty_bands(n_points, float(lam)), (1, n_rows))
+    y = matrix.ravel()
+    weights = np.ones_like(y)
+    for _ in range(n_iter):
+        system = bands.copy()
+        system[2] += weights
+        z = linalg.solveh_banded(system, weights * y, check_finite=False)
+        new_weights = np.where(y > z, p, 1 - p)
+        # rows whose weights are stable give the same z again: stop when all are
+        if np.array_equal(new_weights, weights):
+            break
+        weights = new_weights
+    return z.reshape(n_rows, n_points)
+
+
+def _clean_matrix(matrix, lam, p, spike_threshold, smooth_window):
+    matrix = remove_spikes(matrix, spike_threshold) if spike_threshold else matrix
+    matrix = smooth(matrix, smooth_window) if smooth_window else matrix
+    return matrix - asls_baseline(matrix, lam, p) if lam else matrix
+
+
+# spike removal, smoothing and baseline subtraction of a SpectrumSet
+# spectra of the same length are stacked as matrices, in chunks spread over `jobs` processes
+def preprocess(spectra, lam=1e5, p=0.01, spike_threshold=8.0, smooth_window=7, jobs=1, chunk_size=256):
+    options = (lam, p, spike_threshold, smooth_window)
+    if len(spectra) == 0:
+        return spectra
+    lengths = spectra.lengths
+    if (lengths != lengths[0]).any():
+        # ragged set: group spectra of the same length so that padding never enters the baseline fit
+        cleaned_y = np.empty_like(spectra.y)
+        for length in np.unique(lengths):
+            same_length = lengths == length
+            part = preprocess(spectra.select(same_length), *options, jobs=jobs, chunk_size=chunk_size)
+            cleaned_y[np.repeat(same_length, lengths)] = part.y
+        return spectra._derived(y=cleaned_y)
+
+    matrix = spectra.matrix()
+    chunks = [matrix[start:start + chunk_size] for start in range(0, len(matrix), chunk_size)]
+    if jobs == 1 or len(chunks) == 1:
+        cleaned = [_clean_matrix(chunk, *options) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            cleaned = list(pool.map(_clean_matrix, chunks, *[[option] * len(chunks) for option in options]))
+    return spectra._derived(y=np.concatenate(cleaned, axis=0).ravel())
+
+
+def identify_files(file_paths, grid=default_grid, clean=False):
+    names = [os.path.splitext(os.path.basename(path))[0] for path in file_paths]
+    if clean:
+        spectra = preprocess(SpectrumSet.from_files(file_paths))
+        return identify_phases([np.column_stack(xy) for xy in spectra], names, grid)
+    return identify_phases([read_spectrum(path) for path in file_paths], names, grid)
+
+
+if __name__ == "__main__":
+    import sys
+
+    clean = "--clean" in sys.argv
+    files = [arg for arg in sys.argv[1:] if arg != "--clean"] or sorted(glob.glob(os.path.join(raman_folder, "*.txt")))
+    with pd.option_context("display.width", 200, "display.max_columns", None, "display.precision", 2):
+        print(identify_files(files, clean=clean))
@@ -0,0 +1,145 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# a map is a folder holding cube.npy (ny, nx, n_channels) and wavenumbers.npy (n_channels),
+# always opened memory-mapped so that only the rows being processed are in RAM
+cube_name = "cube.npy"
+wavenumbers_name = "wavenumbers.npy"
+
+# integration windows (cm-1) of the bands shown in fig11
+band_windows = {
+    "hematite": (395.0, 425.0),    # Fe-O, ~410 cm-1
+    "olivine": (810.0, 870.0),     # Si-O doublet, ~820/855 cm-1
+    "serpentine": (365.0, 395.0),  # ~380 cm-1
+    "magnetite": (645.0, 695.0),   # A1g, ~670 cm-1
+}
+
+
+# new empty map, returned writable
+def create_map(folder, shape, wavenumbers, dtype=np.float32):
+    os.makedirs(folder, exist_ok=True)
+    np.save(os.path.join(folder, wavenumbers_name), np.asarray(wavenumbers, dtype=float))
+    return np.lib.format.open_memmap(os.path.join(folder, cube_name), mode="w+", dtype=dtype,
+                                     shape=tuple(shape) + (len(wavenumbers),))
+
+
+# (cube, wavenumbers), cube memory-mapped read-only
+def open_map(folder):
+    cube = np.load(os.path.join(folder, cube_name), mmap_mode="r")
+    return cube, np.load(os.path.join(folder, wavenumbers_name))
+
+
+# long "x y wavenumber intensity" text export (one line per pixel and channel, pixel by pixel)
+# -> map folder, read by chunks of lines
+def import_text_map(text_path, folder, chunk_lines=1_000_000):
+    import pandas as pd
+
+    def chunks():
+        return pd.read_csv(text_path, sep=r"\s+", header=None, comment="#", names=["x", "y", "w", "i"],
+                           chunksize=chunk_lines, dtype=float)
+
+    # first pass: grid and channels, without keeping the intensities
+    xs, ys, wavenumbers, first_pixel = set(), set(), [], None
+    for chunk in chunks():
+        xs.update(np.unique(chunk["x"]))
+        ys.update(np.unique(chunk["y"]))
+        if first_pixel is None:
+            first_pixel = (chunk["x"].iloc[0], chunk["y"].iloc[0])
+        same = (chunk["x"] == first_pixel[0]) & (chunk["y"] == first_pixel[1])
+        wavenumbers.extend(chunk.loc[same, "w"])
+    x_values, y_values = np.sort(list(xs)), np.sort(list(ys))
+    wavenumbers = np.asarray(wavenumbers)
+    order = np.argsort(wavenumbers)
+
+    cube = create_map(folder, (len(y_values), len(x_values)), wavenumbers[order])
+    for chunk in chunks():
+        row = np.searchsorted(y_values, chunk["y"].to_numpy())
+        column = np.searchsorted(x_values, chunk["x"].to_numpy())
+        channel = np.searchsorted(wavenumbers[order], chunk["w"].to_numpy())
+        cube[row, column, channel] = chunk["i"].to_numpy()
+    cube.flush()
+    np.save(os.path.join(folder, "x.npy"), x_values)
+    np.save(os.path.join(folder, "y.npy"), y_values)
+    return folder
+
+
+# area of a band above the straight line joining its window edges, for a block of spectra (..., n_channels)
+def band_area(block, wavenumbers, window):
+    low, high = np.searchsorted(wavenumbers, window[0]), np.searchsorted(wavenumbers, window[1], side="right")
+    if high - low < 2:
+        return np.full(block.shape[:-1], np.nan)
+    x = wavenumbers[low:high]
+    y = np.asarray(block[..., low:high], dtype=float)
+    baseline = y[..., :1] + (y[..., -1:] - y[..., :1]) * (x - x[0]) / (x[-1] - x[0])
+    return np.trapezoid(y - baseline, x, axis=-1) if hasattr(np, "trapezoid") \
+        else np.trapz(y - baseline, x, axis=-1)
+
+
+# worker: band areas for rows [start, end) of a map, written straight into the output memmap
+def _band_chunk(folder, output_path, bands, start, end):
+    cube, wavenumbers = open_map(folder)
+    output = np.load(output_path, mmap_mode="r+")
+    block = cube[start:end]
+    for k, name in enumerate(bands):
+        output[start:end, :, k] = band_area(block, wavenumbers, band_windows[name])
+    output.flush()
+    return end - start
+
+
+# band areas of every pixel: (ny, nx, n_bands) memmap saved as <folder>/bands.npy
+# rows are processed by chunks spread over a worker pool, each worker reading its rows from the cube
+def band_maps(folder, bands=tuple(band_windows), rows_per_chunk=32, jobs=None):
+    bands = list(bands)
+    cube, _ = open_map(folder)
+    output_path = os.path.join(folder, "bands.npy")
+    output = np.lib.format.open_memmap(output_path, mode="w+", dtype=np.float32,
+                                       shape=cube.shape[:2] + (len(bands),))
+    del output
+    starts = range(0, cube.shape[0], rows_per_chunk)
+    ends = [min(start + rows_per_chunk, cube.shape[0]) for start in starts]
+    if jobs == 1:
+        for start, end in zip(starts, ends):
+            _band_chunk(folder, output_path, bands, start, end)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(_band_chunk, [folder] * len(ends), [output_path] * len(ends), [bands] * len(ends),
+                          starts, ends))
+    return np.load(output_path, mmap_mode="r"), bands
+
+
+# ratio map of two bands, e.g. hematite / olivine for the heating front; NaN where the
+# denominator band is absent
+def band_ratio_map(folder, numerator="hematite", denominator="olivine", rows_per_chunk=32, jobs=None):
+    areas, bands = band_maps(folder, [numerator, denominator], rows_per_chunk, jobs)
+    top = np.clip(areas[..., 0], 0, None)
+    bottom = np.clip(areas[..., 1], 0, None)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(bottom > 0, top / bottom, np.nan)
+    np.save(os.path.join(folder, f"ratio_{numerator}_{denominator}.npy"), ratio.astype(np.float32))
+    return ratio
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Band-ratio maps of hyperspectral Raman maps, by chunks of rows.")
+    parser.add_argument("folder", help="map folder (cube.npy + wavenumbers.npy)")
+    parser.add_argument("--import-text", metavar="FILE", help="first convert a 'x y wavenumber intensity' export")
+    parser.add_argument("--numerator", default="hematite", choices=list(band_windows))
+    parser.add_argument("--denominator", default="olivine", choices=list(band_windows))
+    parser.add_argument("--rows", type=int, default=32, help="rows per chunk")
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.import_text:
+        import_text_map(args.import_text, args.folder)
+    ratio = band_ratio_map(args.folder, args.numerator, args.denominator, args.rows, args.jobs)
+    print(f"{args.numerator}/{args.denominator}: {ratio.shape[0]}x{ratio.shape[1]} pixels, "
+          f"median {np.nanmedian(ratio):.3g}, in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import io
+import os
+import numpy as np
+
+from cache import atomic_write, cache_path, file_digest, path_key, read_json, write_json
+from profiling import profiled
+
+
+def _is_number(token):
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+
+# header lines before the data block, e.g. for XRD:
+#   MS01B
+#   Wavelength = 1.54059
+def _parse_header(lines):
+    header = {}
+    for line in lines:
+        if "=" in line:
+            key, value = (part.strip() for part in line.split("=", 1))
+            header[key.lower()] = float(value) if _is_number(value) else value
+        elif line.strip() and "sample" not in header:
+            header["sample"] = line.strip()
+    return header
+
+
+# line by line parser, only used when the data block is not a clean two-column table
+def _parse_lines(lines):
+    data = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 2:
+            try:
+                data.append((float(parts[0]), float(parts[1])))
+            except ValueError:
+                continue
+    return np.array(data, dtype=float).reshape(-1, 2)
+
+
+# parse a two-column spectrum (Raman or XRD) in bulk
+def parse_spectrum(file_path):
+    with open(file_path, "r", encoding="latin-1") as f:
+        text = f.read()
+
+    # header = leading lines that do not start with a number
+    start = 0
+    header_lines = []
+    while start < len(text):
+        end = text.find("\n", start)
+        end = len(text) if end == -1 else end + 1
+        line = text[start:end]
+        tokens = line.split()
+        if tokens and _is_number(tokens[0]):
+            break
+        header_lines.append(line)
+        start = end
+
+    body = text[start:]
+    try:
+        data = np.loadtxt(io.StringIO(body), dtype=float, ndmin=2)
+        if data.shape[1] != 2:
+            raise ValueError
+    except ValueError:
+        data = _parse_lines(body.splitlines())
+    return data.reshape(-1, 2), _parse_header(header_lines)
+
+
+def _save_array(path, data):
+    with open(path, "wb") as f:
+        np.save(f, data)
+
+
+# load a spectrum through the binary cache: (data, header)
+# data is a (n, 2) array memory-mapped copy-on-write, so callers may modify it freely
+def load_spectrum(file_path):
+    key = path_key(file_path)
+    data_path = cache_path("spectra", key + ".npy")
+    meta_path = cache_path("spectra", key + ".json")
+    stat = os.stat(file_path)
+    meta = read_json(meta_path)
+
+    valid = False
+    if meta is not None and os.path.exists(data_path):
+        if meta["mtime_ns"] == stat.st_mtime_ns and meta["size"] == stat.st_size:
+            valid = True
+        elif meta["size"] == stat.st_size and meta["digest"] == file_digest(file_path):
+            # touched but unchanged: refresh the stamp only
+            meta["mtime_ns"] = stat.st_mtime_ns
+            write_json(meta_path, meta)
+            valid = True
+
+    if not valid:
+        data, header = parse_spectrum(file_path)
+        atomic_write(data_path, lambda tmp_path: _save_array(tmp_path, data))
+        meta = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                "digest": file_digest(file_path), "header": header, "n_points": len(data)}
+        write_json(meta_path, meta)
+        return data, header
+
+    if meta["n_points"] == 0:
+        return np.empty((0, 2)), meta["header"]
+    return np.load(data_path, mmap_mode="c"), meta["header"]
+
+
+# drop-in replacement for the former read_raman_file / read_xrd_file
+def read_spectrum(file_path):
+    return load_spectrum(file_path)[0]
+
+
+# many spectra in contiguous arrays: x and y of all spectra concatenated, spectrum i being
+# x[offsets[i]:offsets[i + 1]]; one metadata row per spectrum (name, file, sample, heated, reference...)
+class SpectrumSet:
+    def __init__(self, x, y, offsets, meta=None):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if meta is None:
+            import pandas as pd
+            meta = pd.DataFrame(index=range(len(self.offsets) - 1))
+        self.meta = meta.reset_index(drop=True)
+
+    # load files through the cache; extra keyword arguments become metadata columns (scalar or one per file)
+    @classmethod
+    @profiled("load spectra")
+    def from_files(cls, file_paths, **metadata):
+        import pandas as pd
+
+        loaded = [load_spectrum(path) for path in file_paths]
+        lengths = [len(data) for data, _ in loaded]
+        offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+        xy = np.concatenate([data for data, _ in loaded]) if loaded else np.empty((0, 2))
+        meta = pd.DataFrame([header for _, header in loaded], index=range(len(loaded)))
+        meta.insert(0, "name", [os.path.splitext(os.path.basename(path))[0] for path in file_paths])
+        meta.insert(1, "file", list(file_paths))
+        for column, values in metadata.items():
+            meta[column] = values
+        return cls(xy[:, 0], xy[:, 1], offsets, meta)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # (x, y) views of spectrum i
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.x[start:end], self.y[start:end]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    # x shared by all spectra (same grid), None for ragged sets
+    @property
+    def common_x(self):
+        lengths = self.lengths
+        if len(lengths) == 0 or (lengths != lengths[0]).any():
+            return None
+        grid = self.x.reshape(len(self), lengths[0])
+        return grid[0] if (grid == grid[0]).all() else None
+
+    # y as a (n_spectra, n_points) array when all spectra have the same length
+    def matrix(self):
+        lengths = self.lengths
+        if len(lengths) and (lengths != lengths[0]).any():
+            raise ValueError("spectra of different lengths cannot be stacked")
+        return self.y.reshape(len(self), -1)
+
+    # one value per spectrum -> one value per point
+    def per_point(self, values):
+        return np.repeat(np.asarray(values, dtype=float), self.lengths)
+
+    def _reduce(self, ufunc, values, empty=np.nan):
+        result = np.full(len(self), empty)
+        lengths = self.lengths
+        filled = lengths > 0
+        if filled.any():
+            result[filled] = ufunc.reduceat(values, self.offsets[:-1][filled])
+        return result
+
+    def max(self):
+        return self._reduce(np.maximum, self.y)
+
+    def _derived(self, x=None, y=None, offsets=None, meta=None):
+        return SpectrumSet(self.x if x is None else x, self.y if y is None else y,
+                           self.offsets if offsets is None else offsets, self.meta if meta is None else meta)
+
+    # every spectrum divided by its maximum (times `scale`)
+    def normalize(self, scale=1.0):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self._derived(y=self.y * self.per_point(scale / self.max()))
+
+    # add one vertical offset per spectrum (stacked plots)
+    def offset(self, values):
+        values = np.broadcast_to(np.asarray(values, dtype=float), (len(self),))
+        return self._derived(y=self.y + self.per_point(values))
+
+    # keep the points with x_min <= x <= x_max
+    def crop(self, x_min=-np.inf, x_max=np.inf):
+        keep = (self.x >= x_min) & (self.x <= x_max)
+        counts = self._reduce(np.add, keep.astype(np.int64), empty=0).astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        return self._derived(x=self.x[keep], y=self.y[keep], offsets=offsets)
+
+    # shape-preserving reduction for plotting (M4): the x range of every spectrum is split into
+    # n_buckets equal buckets and only the first, lowest, highest and last point of each bucket are
+    # kept, so peaks and the line ends are exact. With at least one bucket per pixel column the
+    # line covers the same pixels as the full spectrum. Shorter spectra are kept whole.
+    def downsample(self, n_buckets):
+        if not len(self.x):
+            return self
+        x_min = self.per_point(self._reduce(np.minimum, self.x))
+        x_span = self.per_point(self._reduce(np.maximum, self.x)) - x_min
+        with np.errstate(divide="ignore", invalid="ignore"):
+            bucket = np.floor((self.x - x_min) / x_span * n_buckets)
+        bucket = np.clip(np.nan_to_num(bucket), 0, n_buckets - 1).astype(np.int64)
+        key = np.repeat(np.arange(len(self), dtype=np.int64), self.lengths) * n_buckets + bucket
+
+        # points sorted by bucket then intensity: the ends of each run are the bucket min and max
+        order = np.lexsort((self.y, key))
+        starts = np.flatnonzero(np.concatenate([[True], key[order][1:] != key[order][:-1]]))
+        ends = np.concatenate([starts[1:], [len(order)]]) - 1
+        keep = self.per_point(self.lengths <= 4 * n_buckets).astype(bool)
+        keep[order[starts]] = True
+        keep[order[ends]] = True
+        keep[np.minimum.reduceat(order, starts)] = True
+        keep[np.maximum.reduceat(order, starts)] = True
+
+        counts = self._reduce(np.add, keep.astype(np.int64), empty=0).astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        return self._derived(x=self.x[keep], y=self.y[keep], offsets=offsets)
+
+    # subset of spectra (indices or boolean mask over the metadata rows)
+    def select(self, which):
+        index = np.arange(len(self))[np.asarray(which)] if np.asarray(which).dtype == bool \
+            else np.asarray(which, dtype=np.int64)
+        lengths = self.lengths[index]
+        starts = self.offsets[:-1][index]
+        points = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths) \
+            + np.arange(lengths.sum())
+        return SpectrumSet(self.x[points], self.y[points], np.concatenate([[0], np.cumsum(lengths)]),
+                           self.meta.iloc[index])
+
+    # concatenate several sets (metadata rows stacked)
+    @staticmethod
+    def concat(sets):
+        import pandas as pd
+
+        sets = list(sets)
+        offsets = [np.zeros(1, dtype=np.int64)]
+        total = 0
+        for spectrum_set in sets:
+            offsets.append(spectrum_set.offsets[1:] + total)
+            total += spectrum_set.offsets[-1]
+        return SpectrumSet(np.concatenate([s.x for s in sets]), np.concatenate([s.y for s in sets]),
+                           np.concatenate(offsets), pd.concat([s.meta for s in sets], ignore_index=True))
+
+
+# precomputed downsampling levels of a SpectrumSet (finest, finest / factor, ... buckets per spectrum),
+# each level reduced from the previous one; plots pick the coarsest level that still has one bucket
+# per pixel column, so drawing cost no longer depends on the acquisition resolution
+class SpectrumPyramid:
+    def __init__(self, spectra, finest=8192, coarsest=256, factor=4):
+        self.spectra = spectra
+        self.levels = {}
+        level, n_buckets = spectra, finest
+        while n_buckets >= coarsest:
+            level = level.downsample(n_buckets)
+            self.levels[n_buckets] = level
+            n_buckets //= factor
+
+    # coarsest level with at least n_buckets buckets (the full spectra beyond the finest level)
+    def level(self, n_buckets):
+        candidates = [n for n in self.levels if n >= n_buckets]
+        return self.levels[min(candidates)] if candidates else self.spectra
+
+    # level for a matplotlib axes saved at `dpi`: one bucket per pixel column of its width
+    def for_axes(self, ax, dpi=300):
+        width = ax.get_position().width * ax.figure.get_figwidth() * dpi
+        return self.level(int(np.ceil(width)))
@@ -0,0 +1,95 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from tables import file_pms, read_table
+
+blue_types = ["Blue vases"]
+red_types = ["Red vases"]
+
+
+# median SI of each object (one value per vase or experimental sample)
+def pms_medians(vase_types=("Blue vases", "Red vases")):
+    df = read_table(file_pms, columns=["Sample ID", "vase_type", "SI"])
+    df = df[df["vase_type"].isin(vase_types)]
+    return df.groupby(["vase_type", "Sample ID"], as_index=False)["SI"].median()
+
+
+# band of the per-object values of each group: min-max by default, or inner quantiles (e.g. 0.05, 0.95)
+def reference_bands(df, group="vase_type", value="SI", low=0.0, high=1.0):
+    grouped = df.groupby(group, observed=True)[value]
+    return pd.DataFrame({"low": grouped.quantile(low), "high": grouped.quantile(high), "n": grouped.count()})
+
+
+# (low, high) SI band of the blue and the red vases, as shaded in fig08
+# medians: per-vase medians (default: computed from the pMS workbook)
+def si_bands(medians=None, low=0.0, high=1.0):
+    if medians is None:
+        medians = pms_medians(blue_types + red_types)
+    bands = reference_bands(medians, low=low, high=high)
+    blue = bands.loc[blue_types[0], ["low", "high"]].to_numpy(dtype=float)
+    red = bands.loc[red_types[0], ["low", "high"]].to_numpy(dtype=float)
+    return tuple(blue), tuple(red)
+
+
+# quantiles of n_resamples resamples of values, drawn in blocks so memory stays bounded
+def _resample_quantiles(values, quantiles, n_resamples, seed, block_size=4096):
+    rng = np.random.default_rng(seed)
+    out = np.empty((n_resamples, len(quantiles)))
+    for start in range(0, n_resamples, block_size):
+        stop = min(start + block_size, n_resamples)
+        samples = values[rng.integers(0, len(values), size=(stop - start, len(values)))]
+        out[start:stop] = np.quantile(samples, quantiles, axis=1).T
+    return out
+
+
+# percentile bootstrap CI of quantiles (the median by default) of a 1D sample. Resamples are split
+# in chunks with independent seeds, so the result does not depend on the number of jobs.
+def bootstrap_quantiles(values, quantiles=(0.5,), n_resamples=20000, confidence=0.95, seed=0, jobs=1,
+                        chunk_size=5000):
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    quantiles = np.atleast_1d(np.asarray(quantiles, dtype=float))
+    sizes = [min(chunk_size, n_resamples - start) for start in range(0, n_resamples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(values, quantiles, size, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]
+    if jobs > 1 and len(args) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            chunks = list(pool.map(_resample_quantiles, *zip(*args)))
+    else:
+        chunks = [_resample_quantiles(*a) for a in args]
+    resampled = np.concatenate(chunks)
+    alpha = (1 - confidence) / 2
+    return pd.DataFrame({
+        "quantile": quantiles,
+        "estimate": np.quantile(values, quantiles),
+        "low": np.quantile(resampled, alpha, axis=0),
+        "high": np.quantile(resampled, 1 - alpha, axis=0),
+    })
+
+
+# bootstrap CIs of quantiles of value for every group of df
+def bootstrap_groups(df, group="vase_type", value="SI", quantiles=(0.5,), **options):
+    tables = {name: bootstrap_quantiles(values.to_numpy(), quantiles, **options)
+              for name, values in df.groupby(group, observed=True)[value]}
+    return pd.concat(tables, names=[group]).droplevel(-1).set_index("quantile", append=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SI reference bands and bootstrap CIs from the pMS data.")
+    parser.add_argument("-q", "--quantiles", type=float, nargs="+", default=[0.5], help="quantiles to bootstrap")
+    parser.add_argument("-n", "--resamples", type=int, default=20000)
+    parser.add_argument("-c", "--confidence", type=float, default=0.95)
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    df = pms_medians(["Blue vases", "Red vases", "Unheated sample", "Heated sample"])
+    print(reference_bands(df))
+    print(bootstrap_groups(df, quantiles=args.quantiles, n_resamples=args.resamples,
+                           confidence=args.confidence, seed=args.seed, jobs=args.jobs))
+
+
+if __name__ == "__main__":
+    main()
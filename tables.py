@@ -0,0 +1,141 @@
+import os
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from cache import cache_path, file_digest, read_json, write_json
+from profiling import profiled
+
+# workbooks used by the figures
+tables_folder = r"./Suppl data/Tabular data"
+file_pxrf = os.path.join(tables_folder, "suppl data pXRF.xlsx")
+file_pms = os.path.join(tables_folder, "suppl data pMS.xlsx")
+file_munsell = os.path.join(tables_folder, "suppl data Munsell.xlsx")
+file_facies = os.path.join(tables_folder, "suppl data facies.xlsx")
+file_deschamps = os.path.join(tables_folder, "suppl data Deschamps 2013 compil.xlsx")
+file_conv_oxides = os.path.join(tables_folder, "conv_oxides.xlsx")
+
+
+# frames handed over by a parent process (see build.py), keyed by (absolute path, sheet)
+_preloaded = {}
+
+
+# make already loaded tables available to read_table without touching the disk
+def preload_tables(tables):
+    _preloaded.update({(os.path.abspath(path), sheet_name): df for (path, sheet_name), df in tables.items()})
+
+
+def _save_column(path, values):
+    with open(path, "wb") as f:
+        np.save(f, values, allow_pickle=values.dtype == object)
+
+
+# convert one sheet of a workbook to the columnar cache: one .npy file per column
+@profiled("excel parse")
+def _convert(file_path, sheet_name, folder):
+    df = pd.read_excel(file_path, sheet_name=sheet_name)
+    columns = []
+    for i, name in enumerate(df.columns):
+        series = df[name]
+        if isinstance(series.dtype, np.dtype) and series.dtype != object:
+            values = series.to_numpy()
+        else:
+            # strings and mixed columns ("n.d.", "<0.2", numbers...) are kept as python objects
+            values = series.to_numpy(dtype=object)
+        column_file = f"c{i:03d}.npy"
+        _save_column(os.path.join(folder, column_file), values)
+        columns.append({"name": str(name), "file": column_file, "dtype": str(series.dtype)})
+    write_json(os.path.join(folder, "columns.json"), {"source": os.path.basename(file_path),
+                                                      "n_rows": len(df), "columns": columns})
+
+
+# numeric columns can be memory-mapped; object columns (pickled) are always read whole
+def _load_column(folder, column, mmap=False):
+    path = os.path.join(folder, column["file"])
+    try:
+        values = np.load(path, mmap_mode="r" if mmap else None, allow_pickle=True)
+    except ValueError:
+        # Python objects cannot be memory-mapped
+        values = np.load(path, allow_pickle=True)
+    if values.dtype == object and column["dtype"] != "object":
+        return pd.array(values, dtype=column["dtype"])
+    return values
+
+
+# cache folder and metadata of the requested columns, converting the sheet on first use
+def _cached_columns(file_path, columns, sheet_name):
+    folder = os.path.dirname(cache_path("tables", f"{file_digest(file_path)}-{sheet_name}", "columns.json"))
+    meta = read_json(os.path.join(folder, "columns.json"))
+    if meta is None:
+        _convert(file_path, sheet_name, folder)
+        meta = read_json(os.path.join(folder, "columns.json"))
+
+    by_name = {column["name"]: column for column in meta["columns"]}
+    if columns is None:
+        columns = list(by_name)
+    missing = [name for name in columns if name not in by_name]
+    if missing:
+        raise KeyError(f"{missing} not in {file_path}")
+    return folder, meta["n_rows"], [by_name[name] for name in columns]
+
+
+# read a sheet of an Excel workbook through the columnar cache
+# the XLSX is only parsed when its content hash changes; only the requested columns are loaded
+@profiled()
+def read_table(file_path, columns=None, sheet_name=0):
+    preloaded = _preloaded.get((os.path.abspath(file_path), sheet_name))
+    if preloaded is not None:
+        return preloaded[list(preloaded.columns) if columns is None else list(columns)].copy()
+
+    folder, _, selected = _cached_columns(file_path, columns, sheet_name)
+    return pd.DataFrame({column["name"]: _load_column(folder, column) for column in selected},
+                        columns=pd.Index([column["name"] for column in selected]))
+
+
+# the same table in blocks of `chunk_rows` rows: numeric columns are memory-mapped from the column
+# cache, so a block is only copied into memory when it is yielded (large compilations)
+def read_table_chunks(file_path, columns=None, chunk_rows=100_000, sheet_name=0):
+    preloaded = _preloaded.get((os.path.abspath(file_path), sheet_name))
+    if preloaded is not None:
+        df = preloaded[list(preloaded.columns) if columns is None else list(columns)]
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows].copy()
+        return
+
+    folder, n_rows, selected = _cached_columns(file_path, columns, sheet_name)
+    values = {column["name"]: _load_column(folder, column, mmap=True) for column in selected}
+    for start in range(0, n_rows, chunk_rows):
+        index = pd.RangeIndex(start, min(start + chunk_rows, n_rows))
+        yield pd.DataFrame({name: np.array(column[start:start + chunk_rows]) if isinstance(column, np.ndarray)
+                            else column[start:start + chunk_rows] for name, column in values.items()},
+                           index=index, columns=pd.Index(list(values)))
+
+
+# typed schema: label columns as categoricals, measurements as float32 (text entries such as
+# "n.d." or "<0.2" become NaN here, once). Returns a new frame sharing the untouched columns.
+def apply_schema(df, categorical=(), float32=()):
+    typed = {}
+    for column in categorical:
+        if column in df.columns:
+            typed[column] = df[column].astype("category")
+    for column in float32:
+        if column in df.columns:
+            values = df[column]
+            if not pd.api.types.is_numeric_dtype(values):
+                values = pd.to_numeric(values, errors="coerce")
+            typed[column] = values.astype(np.float32)
+    return df.assign(**typed)
+
+
+# stack typed blocks (read_table_chunks): categoricals are merged column by column
+# without going through object columns
+def concat_tables(frames):
+    frames = list(frames)
+    columns = {}
+    for column in frames[0].columns:
+        parts = [df[column] for df in frames]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            columns[column] = pd.Series(union_categoricals(parts, ignore_order=True))
+        else:
+            columns[column] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns, columns=frames[0].columns)
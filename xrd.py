@@ -0,0 +1,130 @@
+import glob
+import os
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+
+from spectra import load_spectrum
+
+xrd_folder = r"./Suppl data/Spectra/XRD spectra"
+# 2θ positions (°) of the diagnostic peaks for Cu Kα1, as drawn in fig12
+reference_wavelength = 1.54059
+phase_peaks = {
+    "Olivine": [17.2, 22.8, 35.5, 52.2],
+    "Serpentine": [12.1, 19.4, 24.6],
+    "Magnetite": [37.3],
+    "Hematite": [33.2],
+}
+
+
+# 2θ measured with one wavelength -> 2θ of the same d-spacing with another (Bragg's law)
+def convert_two_theta(two_theta, from_wavelength, to_wavelength):
+    sin_theta = np.sin(np.radians(np.asarray(two_theta, dtype=float)) / 2) * to_wavelength / from_wavelength
+    with np.errstate(invalid="ignore"):
+        return np.degrees(2 * np.arcsin(np.where(np.abs(sin_theta) <= 1, sin_theta, np.nan)))
+
+
+def d_spacing(two_theta, wavelength=reference_wavelength):
+    with np.errstate(divide="ignore"):
+        return wavelength / (2 * np.sin(np.radians(np.asarray(two_theta, dtype=float)) / 2))
+
+
+# patterns -> NaN-padded (n_patterns, n_max) matrices of 2θ and intensity
+def pad_patterns(patterns):
+    n_max = max((len(data) for data in patterns), default=0)
+    two_theta = np.full((len(patterns), n_max), np.nan)
+    intensity = np.full((len(patterns), n_max), np.nan)
+    for i, data in enumerate(patterns):
+        two_theta[i, :len(data)] = data[:, 0]
+        intensity[i, :len(data)] = data[:, 1]
+    return two_theta, intensity
+
+
+# peaks of every pattern at once: local maxima standing above a running background by `min_snr` noise levels
+# window and background_window are in points; returns a flat table (pattern, 2θ, net intensity)
+def find_peaks(two_theta, intensity, window=11, background_window=151, min_snr=5.0):
+    valid = np.isfinite(intensity)
+    filled = np.where(valid, intensity, 0.0)
+    smooth = ndimage.uniform_filter1d(filled, size=3, axis=1, mode="nearest")
+    # rolling minimum then smoothing: a broad background under the peaks (amorphous hump, fluorescence)
+    background = ndimage.uniform_filter1d(ndimage.minimum_filter1d(np.where(valid, smooth, np.inf), background_window,
+                                                                   axis=1, mode="nearest"),
+                                          background_window, axis=1, mode="nearest")
+    net = smooth - np.where(np.isfinite(background), background, 0.0)
+    # noise level from the point-to-point scatter (MAD of first differences)
+    diffs = np.diff(np.where(valid, intensity, np.nan), axis=1)
+    noise = 1.4826 * np.nanmedian(np.abs(diffs - np.nanmedian(diffs, axis=1, keepdims=True)), axis=1) / np.sqrt(2)
+    noise = np.where(np.isfinite(noise) & (noise > 0), noise, 1.0)
+
+    is_peak = (valid & (smooth == ndimage.maximum_filter1d(smooth, window, axis=1, mode="nearest"))
+               & (net > min_snr * noise[:, None]))
+    rows, columns = np.nonzero(is_peak)
+    return pd.DataFrame({"pattern": rows, "2θ": two_theta[rows, columns], "net intensity": net[rows, columns]})
+
+
+# match detected peaks to the phase table within `tolerance` (° 2θ, at each pattern's own wavelength)
+# returns (peaks with their phase, fraction of reference peaks found per phase, max relative intensity per phase)
+def index_phases(peaks, wavelengths, samples, tolerance=0.3, phases=phase_peaks):
+    peaks = peaks.copy()
+    peaks["relative intensity"] = peaks["net intensity"] / peaks.groupby("pattern")["net intensity"].transform("max")
+
+    # padded (n_patterns, n_peaks_max) matrices of the detected peaks
+    n_patterns = len(samples)
+    rank = peaks.groupby("pattern").cumcount().to_numpy()
+    n_max = int(rank.max()) + 1 if len(peaks) else 1
+    positions = np.full((n_patterns, n_max), np.nan)
+    relative = np.zeros((n_patterns, n_max))
+    positions[peaks["pattern"], rank] = peaks["2θ"]
+    relative[peaks["pattern"], rank] = peaks["relative intensity"]
+
+    # reference peaks converted to each pattern's wavelength: (n_patterns, n_ref)
+    ref_phase = np.array([phase for phase, positions_ in phases.items() for _ in positions_])
+    ref_positions = np.array([position for positions_ in phases.values() for position in positions_])
+    expected = convert_two_theta(ref_positions[None, :], reference_wavelength, np.asarray(wavelengths)[:, None])
+
+    distance = np.abs(positions[:, None, :] - expected[:, :, None])  # (n_patterns, n_ref, n_peaks_max)
+    distance = np.where(np.isfinite(distance), distance, np.inf)
+    nearest = np.argmin(distance, axis=2)
+    found = np.take_along_axis(distance, nearest[:, :, None], axis=2)[:, :, 0] <= tolerance
+    found_intensity = np.where(found, np.take_along_axis(relative, nearest, axis=1), 0.0)
+
+    # phase of each detected peak (closest matching reference peak)
+    peaks["phase"] = None
+    best_ref = np.argmin(distance, axis=1)  # (n_patterns, n_peaks_max)
+    best_distance = np.take_along_axis(distance, best_ref[:, None, :], axis=1)[:, 0, :]
+    matched = best_distance[peaks["pattern"], rank] <= tolerance
+    peaks.loc[matched, "phase"] = ref_phase[best_ref[peaks["pattern"], rank][matched]]
+    peaks.insert(0, "Sample", np.asarray(samples, dtype=object)[peaks["pattern"]])
+    peaks["d (Å)"] = d_spacing(peaks["2θ"], np.asarray(wavelengths)[peaks["pattern"]])
+
+    names = list(phases)
+    fraction = pd.DataFrame({phase: found[:, ref_phase == phase].mean(axis=1) for phase in names},
+                            index=pd.Index(samples, name="Sample"))
+    intensity = pd.DataFrame({phase: found_intensity[:, ref_phase == phase].max(axis=1) for phase in names},
+                             index=pd.Index(samples, name="Sample"))
+    return peaks.drop(columns="pattern"), fraction, intensity
+
+
+# whole stage for a list of files: wavelength read from each header (Cu Kα1 if absent)
+# returns (peaks, phase presence, relative intensity); a phase is present when at least
+# `min_fraction` of its reference peaks are found
+def analyse_files(file_paths, tolerance=0.3, min_fraction=0.5, **peak_options):
+    loaded = [load_spectrum(path) for path in file_paths]
+    samples = [header.get("sample", os.path.splitext(os.path.basename(path))[0])
+               for path, (_, header) in zip(file_paths, loaded)]
+    wavelengths = [float(header.get("wavelength", reference_wavelength)) for _, header in loaded]
+    two_theta, intensity = pad_patterns([data for data, _ in loaded])
+
+    peaks = find_peaks(two_theta, intensity, **peak_options)
+    peaks, fraction, relative_intensity = index_phases(peaks, wavelengths, samples, tolerance)
+    presence = fraction >= min_fraction
+    return peaks, presence, relative_intensity
+
+
+if __name__ == "__main__":
+    import sys
+
+    files = sys.argv[1:] or sorted(glob.glob(os.path.join(xrd_folder, "*.txt")))
+    peaks, presence, relative_intensity = analyse_files(files)
+    with pd.option_context("display.width", 200, "display.max_columns", None, "display.precision", 2):
+        print(presence, relative_intensity, sep="\n\n")